@@ -0,0 +1,106 @@
+"""
+Content Renderer - Render exercise content (geometric schemas + LaTeX) in worker processes
+
+Both steps are CPU-bound (matplotlib) and would otherwise run on the event loop
+of the request that needs them.
+"""
+
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+from geometry_renderer import geometry_renderer
+from latex_to_svg import latex_renderer
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def render_content(content: str) -> Tuple[str, bool]:
+    """Render schemas and LaTeX of a content string, returns (content, failed)
+
+    A failing step leaves its input unchanged and the other step still runs.
+    """
+    failed = False
+
+    # 1. Process legacy geometric schemas (for backward compatibility)
+    try:
+        content = geometry_renderer.process_geometric_schemas_for_web(content)
+    except Exception as e:
+        failed = True
+        logger.error(f"Error processing legacy geometric schemas: {e}")
+
+    # 2. Process LaTeX formulas
+    try:
+        content = latex_renderer.convert_latex_to_svg(content)
+    except Exception as e:
+        failed = True
+        logger.error(f"Error processing LaTeX: {e}")
+
+    return content, failed
+
+
+def render_contents(contents: List[str]) -> List[Tuple[str, bool]]:
+    """Render a chunk of contents (executed inside a worker process)"""
+    return [render_content(content) for content in contents]
+
+
+def warm_up_worker():
+    """Worker initializer: pay matplotlib's first-figure cost before real work arrives"""
+    try:
+        render_content("\\(x\\)")
+    except Exception:
+        pass
+
+
+class ContentRenderPool:
+    """Process pool dedicated to exercise content rendering, created lazily on first use
+
+    Each worker keeps its own formula cache across the contents it renders, and
+    workers are recycled after a fixed number of chunks to bound matplotlib's
+    memory growth.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_tasks_per_child: int = 200):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up_worker,
+                max_tasks_per_child=self.max_tasks_per_child
+            )
+        return self._executor
+
+    async def render_many(self, contents: List[str]) -> List[Tuple[str, bool]]:
+        """Render contents across the workers, results in input order"""
+        if not contents:
+            return []
+
+        # One chunk per worker keeps the pickling overhead per content low
+        chunk_size = -(-len(contents) // self.max_workers)
+        chunks = [contents[i:i + chunk_size] for i in range(0, len(contents), chunk_size)]
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(executor, render_contents, chunk) for chunk in chunks
+        ])
+        return [rendered for chunk_results in results for rendered in chunk_results]
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+# Global instance
+content_render_pool = ContentRenderPool(
+    max_workers=int(os.environ.get('CONTENT_RENDER_WORKERS', 0)) or None
+)
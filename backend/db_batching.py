@@ -0,0 +1,155 @@
+"""
+DB Batching - Coalesce concurrent MongoDB lookups into single round-trips
+"""
+
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Hashable, Optional
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+
+
+class _CoalescingBatcher(ABC):
+    """Collects keys requested within a short window and resolves them with one query"""
+
+    # Value returned for keys the query didn't match
+    _missing: Any = None
+
+    def __init__(self, window: float = 0.001, max_batch: int = 500):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def get(self, key: Hashable):
+        """Wait for the value of a key, sharing the query with concurrent callers"""
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.window, self._flush)
+        # Shielded so one cancelled caller doesn't cancel the result for the others
+        return await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, {}
+        task = asyncio.get_running_loop().create_task(self._resolve(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resolve(self, batch: Dict[Hashable, asyncio.Future]):
+        try:
+            results = await self._fetch(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key, self._missing))
+
+    @abstractmethod
+    async def _fetch(self, keys: list) -> Dict[Hashable, Any]:
+        """Query the values of a batch of keys, returns key -> value for the keys found"""
+
+
+class MongoBatcher(_CoalescingBatcher):
+    """Batched find_one by a single field: concurrent get(value) calls become one $in query"""
+
+    def __init__(self, collection, key_field: str, projection: Optional[dict] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.collection = collection
+        self.key_field = key_field
+        self.projection = projection
+
+    async def _fetch(self, keys: list) -> Dict[Hashable, Any]:
+        results = {}
+        cursor = self.collection.find({self.key_field: {"$in": keys}}, self.projection)
+        async for doc in cursor:
+            results.setdefault(doc[self.key_field], doc)
+        return results
+
+
+class BulkInserter:
+    """Coalesces inserts issued within a short window into one unordered bulk_write
+
+    ``await insert(doc)`` returns once the batch containing the document has been
+    acknowledged, so callers keep read-your-writes semantics and see write errors.
+    """
+
+    def __init__(self, collection, window: float = 0.005, max_batch: int = 500):
+        self.collection = collection
+        self.window = window
+        self.max_batch = max_batch
+        self._docs = []
+        self._futures = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+
+    async def insert(self, doc: dict):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._docs.append(doc)
+        self._futures.append(future)
+        if len(self._docs) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        await asyncio.shield(future)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._docs:
+            return
+
+        docs, futures = self._docs, self._futures
+        self._docs, self._futures = [], []
+        task = asyncio.get_running_loop().create_task(self._write(docs, futures))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, docs: list, futures: list):
+        try:
+            await self.collection.bulk_write([InsertOne(doc) for doc in docs], ordered=False)
+        except BulkWriteError as e:
+            # Unordered: only the documents listed in writeErrors failed
+            failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            for index, future in enumerate(futures):
+                if future.done():
+                    continue
+                if index in failed:
+                    future.set_exception(BulkWriteError({"writeErrors": [failed[index]]}))
+                else:
+                    future.set_result(None)
+            return
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future in futures:
+            if not future.done():
+                future.set_result(None)
+
+    async def flush(self):
+        """Write out anything pending and wait for in-flight batches (used on shutdown)"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,125 @@
+"""
+Exercise Icons - Type and icon of an exercise from its AI type, chapter or statement
+"""
+
+import re
+import unicodedata
+from typing import Optional
+
+
+# Icon mapping for exercises - Professional cascading logic
+EXERCISE_ICON_MAPPING = {
+    # Priority 1: By exercise type (most robust)
+    "geometry": "triangle-ruler",
+    "algebra": "calculator",
+    "statistics": "bar-chart",
+    "probability": "dice-6",
+    "text": "file-text",
+    
+    # Priority 2: By chapter (fallback)
+    "Théorème de Pythagore": "triangle-ruler",
+    "Théorème de Thalès": "triangle-ruler", 
+    "Trigonométrie": "triangle-ruler",
+    "Géométrie": "triangle-ruler",
+    "Géométrie dans l'espace": "cube",
+    "Géométrie - Triangles et quadrilatères": "triangle-ruler",
+    "Fractions": "calculator",
+    "Équations": "calculator",
+    "Fonctions": "function-square",
+    "Statistiques": "bar-chart",
+    "Probabilités": "dice-6",
+    "Volumes": "cube",
+    
+    # Physics-Chemistry icons (future expansion)
+    "Matière": "atom",
+    "Énergie": "zap",
+    "Forces": "magnet",
+    
+    # Priority 3: Default fallback
+    "default": "book-open"
+}
+
+def normalize_chapter(name: str) -> str:
+    """Chapter name without case or accent differences ("théorème" == "Theoreme")"""
+    decomposed = unicodedata.normalize('NFKD', name.casefold().strip())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+# EXERCISE_ICON_MAPPING by normalized key, so chapter names from AI output with
+# other casing or accents still take the chapter fast path
+EXERCISE_ICON_MAPPING_NORMALIZED = {normalize_chapter(key): icon for key, icon in EXERCISE_ICON_MAPPING.items()}
+
+def _keyword_rules(*rules):
+    """(type, keywords) pairs in priority order -> (regex, types)
+    
+    The regex finds the keywords of every type in a single scan: each type is a named
+    lookahead group, so a match reports its type through lastgroup.
+    """
+    pattern = "|".join(
+        f"(?=(?P<{exercise_type}>{'|'.join(map(re.escape, keywords))}))"
+        for exercise_type, keywords in rules
+    )
+    return re.compile(pattern), tuple(exercise_type for exercise_type, _ in rules)
+
+# Exercise type inferred from the chapter name, then from the statement text
+# Chapter keywords are matched against normalize_chapter(chapitre), without accents,
+# so the type agrees with the normalized icon lookup
+CHAPTER_TYPE_RULES = _keyword_rules(
+    ("geometry", ["geometrie", "pythagore", "thales", "trigonometrie", "triangle", "volume"]),
+    ("algebra", ["equation", "fonction", "fraction", "algebre", "calcul"]),
+    ("statistics", ["statistique", "probabilite"]),
+)
+ENONCE_TYPE_RULES = _keyword_rules(
+    ("geometry", ["triangle", "cercle", "carré", "rectangle", "géométrique", "angle", "côté", "volume", "aire"]),
+    ("algebra", ["équation", "fonction", "fraction", "calcul", "nombre", "résoudre", "simplifier"]),
+    ("statistics", ["statistique", "moyenne", "graphique", "données", "probabilité", "hasard"]),
+)
+ENONCE_TYPE_ICONS = {"geometry": "triangle-ruler", "algebra": "calculator", "statistics": "bar-chart"}
+
+def match_keyword_rules(text: str, rules) -> Optional[str]:
+    """Highest-priority type whose keywords appear in the (lowercased) text"""
+    keywords_re, types = rules
+    best_rank = None
+    for match in keywords_re.finditer(text):
+        rank = types.index(match.lastgroup)
+        if rank == 0:
+            return types[0]
+        if best_rank is None or rank < best_rank:
+            best_rank = rank
+    return types[best_rank] if best_rank is not None else None
+
+def enrich_exercise_with_icon(exercise_data: dict, chapitre: str) -> dict:
+    """
+    Professional cascading icon enrichment logic:
+    1. Priority: Use type from AI if provided and valid
+    2. Fallback: Use chapter-based mapping  
+    3. Detection: Analyze content for type hints
+    4. Default: Use generic icon
+    """
+    
+    # Priority 1: Use type from AI if provided and valid
+    ai_type = exercise_data.get("type", "").lower()
+    if ai_type in EXERCISE_ICON_MAPPING:
+        exercise_data["icone"] = EXERCISE_ICON_MAPPING[ai_type]
+        exercise_data["type"] = ai_type  # Ensure type is set
+        return exercise_data
+    
+    # Priority 2: Use chapter-based mapping
+    chapter_icon = EXERCISE_ICON_MAPPING_NORMALIZED.get(normalize_chapter(chapitre)) if chapitre else None
+    if chapter_icon:
+        exercise_data["icone"] = chapter_icon
+        # Infer type from chapter
+        exercise_data["type"] = match_keyword_rules(normalize_chapter(chapitre), CHAPTER_TYPE_RULES) or "text"
+        return exercise_data
+    
+    # Priority 3: Content-based detection (for unknown chapters)
+    enonce = exercise_data.get("enonce", "").lower()
+    detected_type = match_keyword_rules(enonce, ENONCE_TYPE_RULES)
+    if detected_type:
+        exercise_data["type"] = detected_type
+        exercise_data["icone"] = ENONCE_TYPE_ICONS[detected_type]
+    else:
+        # Priority 4: Default fallback
+        exercise_data["type"] = "text"
+        exercise_data["icone"] = EXERCISE_ICON_MAPPING["default"]
+    
+    return exercise_data
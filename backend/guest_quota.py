@@ -0,0 +1,113 @@
+"""
+Guest Quota - Rolling-window export quota for guest users
+
+Each guest has one guest_quotas document (unique guest_id index) holding the
+exports of the window as {"id", "at"} entries. Reservations are made with a single
+pipeline update, so concurrent exports can't both pass the check.
+"""
+
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Free exports per guest over a rolling window
+GUEST_MAX_EXPORTS = 3
+GUEST_EXPORT_QUOTA_WINDOW = timedelta(days=30)
+
+# MongoDB error code for a unique index violation
+DUPLICATE_KEY_ERROR = 11000
+
+
+class GuestQuotaStore:
+    """Reserve, release and seed guest exports in the guest_quotas collection"""
+
+    def __init__(self, collection, max_exports: int, window: timedelta):
+        self.collection = collection
+        self.max_exports = max_exports
+        self.window = window
+
+    def _reserve_pipeline(self, reservation_id: str, now: datetime) -> list:
+        under_cap = {"$lt": [{"$size": "$exports"}, self.max_exports]}
+        return [
+            # Drop the exports that left the window
+            {"$set": {"exports": {"$filter": {
+                "input": {"$ifNull": ["$exports", []]},
+                "cond": {"$gte": ["$$this.at", now - self.window]}
+            }}}},
+            # Append the new one only while under the cap
+            {"$set": {
+                "reservation": {"$cond": [under_cap, reservation_id, None]},
+                "exports": {"$cond": [
+                    under_cap,
+                    {"$concatArrays": ["$exports", [{"id": reservation_id, "at": now}]]},
+                    "$exports"
+                ]}
+            }}
+        ]
+
+    async def reserve(self, guest_id: str) -> Optional[str]:
+        """Atomically take one of the guest's exports, returns a reservation id or None when the quota is reached"""
+        reservation_id = str(uuid.uuid4())
+        pipeline = self._reserve_pipeline(reservation_id, datetime.now(timezone.utc))
+
+        # Two first exports of a new guest can both try to insert its document: the
+        # loser gets a duplicate key error and retries as an update of the winner's
+        for attempt in range(2):
+            try:
+                quota = await self.collection.find_one_and_update(
+                    {"guest_id": guest_id},
+                    pipeline,
+                    projection={"_id": 0, "reservation": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                break
+            except DuplicateKeyError:
+                if attempt:
+                    raise
+        return reservation_id if quota and quota.get("reservation") == reservation_id else None
+
+    async def release(self, guest_id: str, reservation_id: str):
+        """Give back a reserved export whose PDF could not be produced"""
+        try:
+            await self.collection.update_one({"guest_id": guest_id}, {"$pull": {"exports": {"id": reservation_id}}})
+        except Exception as e:
+            logger.error(f"Error releasing guest export: {e}")
+
+    async def seed_from_exports(self, exports_collection) -> int:
+        """Create the quota documents of guests who only have exports recorded before guest_quotas existed
+
+        Idempotent: guests that already have a quota document are left untouched.
+        Returns the number of documents created. This scans the recent exports, so it
+        is run once by migrate_guest_quotas.py rather than on every startup.
+        """
+        cutoff = datetime.now(timezone.utc) - self.window
+        pipeline = [
+            {"$match": {"guest_id": {"$type": "string"}, "created_at": {"$gte": cutoff}}},
+            {"$group": {"_id": "$guest_id", "exports": {"$push": {"id": "$id", "at": "$created_at"}}}}
+        ]
+        operations = []
+        async for row in exports_collection.aggregate(pipeline):
+            operations.append(UpdateOne(
+                {"guest_id": row["_id"]},
+                {"$setOnInsert": {"exports": row["exports"]}},
+                upsert=True
+            ))
+
+        if not operations:
+            return 0
+        try:
+            result = await self.collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Another worker seeding (or a guest exporting) at the same time already created the document
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+                raise
+            return e.details.get("nUpserted", 0)
+        return result.upserted_count
@@ -9,11 +9,66 @@ import os
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
+from logger import get_logger
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+logger = get_logger(__name__)
+
+# (collection, keys, options) of every index the application relies on
+INDEXES = [
+    # One session per user
+    ("login_sessions", "user_email", {"unique": True, "name": "unique_user_session"}),
+    # Session validation on every authenticated request
+    ("login_sessions", "session_token", {"unique": True, "name": "unique_session_token"}),
+    # Auto-cleanup expired sessions
+    ("login_sessions", "expires_at", {"expireAfterSeconds": 0, "name": "session_expiry_ttl"}),  # Expire at the specified date
+    # Magic link verification
+    ("magic_tokens", "token", {"unique": True, "name": "unique_magic_token"}),
+    # Auto-cleanup expired magic tokens
+    ("magic_tokens", "expires_at", {"expireAfterSeconds": 0, "name": "magic_token_ttl"}),  # Expire at the specified date
+    # Fast, unique lookups on Pro users
+    ("pro_users", "email", {"unique": True, "name": "unique_pro_user_email"}),
+    # Guest export quota, one document per guest updated atomically
+    ("guest_quotas", "guest_id", {"unique": True, "name": "unique_guest_quota"}),
+    # Document lookups by public id (export, vary)
+    ("documents", "id", {"unique": True, "name": "unique_document_id"}),
+    # Guest document listing (guest_id equality, newest first)
+    ("documents", [("guest_id", 1), ("created_at", -1)], {"name": "guest_documents_by_date"}),
+    # Idempotent Stripe webhook processing (retried deliveries are rejected by the index)
+    ("webhook_events", "event_id", {"unique": True, "name": "unique_webhook_event"}),
+    # Checkout status polling and webhook updates by Stripe session id
+    ("payment_transactions", "session_id", {"unique": True, "name": "unique_payment_session"}),
+    # One template configuration per Pro user
+    ("user_templates", "user_email", {"unique": True, "name": "unique_user_template"}),
+]
+
+# Unique indexes that writes rely on for correctness, not just speed: webhook
+# deduplication, the guest quota upsert and Pro provisioning (one user per email)
+REQUIRED_INDEXES = {"unique_webhook_event", "unique_guest_quota", "unique_pro_user_email"}
+
+async def ensure_indexes(db):
+    """Create the indexes the application relies on (idempotent, safe to run at startup)
+    
+    Each index is created on its own, so one failure (e.g. a unique index on existing
+    duplicates) doesn't skip the others. Returns the names of the indexes that could not
+    be created, and raises RuntimeError if one of REQUIRED_INDEXES is among them.
+    """
+    failed = []
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except Exception as e:
+            logger.error(f"Could not create index {options['name']} on {collection}: {e}")
+            failed.append(options["name"])
+
+    missing_required = [name for name in failed if name in REQUIRED_INDEXES]
+    if missing_required:
+        raise RuntimeError(f"Required indexes could not be created: {', '.join(missing_required)}")
+    return failed
+
 async def init_database_indexes():
     """Initialize database indexes for security and performance"""
     try:
@@ -24,43 +79,14 @@ async def init_database_indexes():
         
         print("🔧 Initializing database indexes for Le Maître Mot...")
         
-        # 1. Unique index on login_sessions.user_email (one session per user)
-        print("Creating unique index on login_sessions.user_email...")
-        await db.login_sessions.create_index(
-            "user_email", 
-            unique=True,
-            name="unique_user_session"
-        )
-        print("✅ Unique session per user index created")
-        
-        # 2. TTL index on login_sessions.expires_at (auto-cleanup expired sessions)
-        print("Creating TTL index on login_sessions.expires_at...")
-        await db.login_sessions.create_index(
-            "expires_at",
-            expireAfterSeconds=0,  # Expire at the specified date
-            name="session_expiry_ttl"
-        )
-        print("✅ Session expiry TTL index created")
-        
-        # 3. TTL index on magic_tokens.expires_at (auto-cleanup expired tokens)
-        print("Creating TTL index on magic_tokens.expires_at...")
-        await db.magic_tokens.create_index(
-            "expires_at",
-            expireAfterSeconds=0,  # Expire at the specified date
-            name="magic_token_ttl"
-        )
-        print("✅ Magic token TTL index created")
-        
-        # 4. Index on pro_users.email for fast lookups
-        print("Creating index on pro_users.email...")
-        await db.pro_users.create_index(
-            "email",
-            unique=True,
-            name="unique_pro_user_email"
-        )
-        print("✅ Pro user unique email index created")
+        print("Creating indexes (sessions, magic tokens, pro users, guest quotas, documents, webhook events, payments, templates)...")
+        failed = await ensure_indexes(db)
+        if failed:
+            print(f"⚠️ Indexes not created: {', '.join(failed)}")
+        else:
+            print("✅ Indexes created")
         
-        # 5. Cleanup any duplicate sessions (in case they exist)
+        # Cleanup any duplicate sessions (in case they exist)
         print("Cleaning up any duplicate sessions...")
         
         # Find duplicate sessions
@@ -75,6 +101,7 @@ async def init_database_indexes():
         
         if duplicates:
             print(f"Found {len(duplicates)} users with duplicate sessions")
+            ids_to_delete = []
             for dup in duplicates:
                 user_email = dup["_id"]
                 sessions = dup["sessions"]
@@ -83,9 +110,12 @@ async def init_database_indexes():
                 sessions.sort(key=lambda x: x.get("created_at", ""), reverse=True)
                 sessions_to_delete = sessions[1:]  # All except the most recent
                 
-                for session in sessions_to_delete:
-                    await db.login_sessions.delete_one({"_id": session["_id"]})
-                    print(f"  Removed duplicate session for {user_email}")
+                ids_to_delete.extend(session["_id"] for session in sessions_to_delete)
+                print(f"  Removing {len(sessions_to_delete)} duplicate sessions for {user_email}")
+            
+            # One round-trip for every duplicate
+            result = await db.login_sessions.delete_many({"_id": {"$in": ids_to_delete}})
+            print(f"  Removed {result.deleted_count} duplicate sessions")
         else:
             print("No duplicate sessions found")
         
@@ -94,7 +124,9 @@ async def init_database_indexes():
         print("  ✅ One session per user (unique constraint)")
         print("  ✅ Automatic session cleanup on expiry")
         print("  ✅ Automatic magic token cleanup")
+        print("  ✅ Indexed session and magic token lookups")
         print("  ✅ Pro user email uniqueness")
+        print("  ✅ Stripe webhook events processed once")
         
         # Close connection
         client.close()
@@ -129,8 +129,8 @@ class AppLogger:
         console_handler.setFormatter(formatter)
         logger.addHandler(console_handler)
 
-        # File handler with rotation
-        log_dir = "backend/log"
+        # File handler with rotation (APP_LOG_DIR lets tests log outside the repository)
+        log_dir = os.getenv('APP_LOG_DIR', "backend/log")
         os.makedirs(log_dir, exist_ok=True)
 
         file_handler = RotatingFileHandler(
@@ -147,8 +147,12 @@ class AppLogger:
 
         return logger
     
-    def _create_log_record(self, level: str, message: str, **kwargs) -> None:
-        """Create a log record with custom fields"""
+    def _create_log_record(self, level: str, message: str, *args, **kwargs) -> None:
+        """Create a log record with custom fields
+        
+        Positional args are passed through to the standard logging call so that
+        %-style messages are only formatted when the level is enabled.
+        """
         extra = {}
         
         # Handle exc_info separately (it's a special logging parameter)
@@ -163,27 +167,32 @@ class AppLogger:
                 extra[f'log_{key}'] = value
         
         # Log the message with exc_info as a parameter, not in extra
-        getattr(self.logger, level.lower())(message, extra=extra, exc_info=exc_info)
+        getattr(self.logger, level.lower())(message, *args, extra=extra, exc_info=exc_info)
     
-    def debug(self, message: str, **kwargs):
+    def debug(self, message: str, *args, **kwargs):
         """Debug level logging"""
-        self._create_log_record('DEBUG', message, **kwargs)
+        self._create_log_record('DEBUG', message, *args, **kwargs)
     
-    def info(self, message: str, **kwargs):
+    def info(self, message: str, *args, **kwargs):
         """Info level logging"""
-        self._create_log_record('INFO', message, **kwargs)
+        self._create_log_record('INFO', message, *args, **kwargs)
     
-    def warning(self, message: str, **kwargs):
+    def warning(self, message: str, *args, **kwargs):
         """Warning level logging"""
-        self._create_log_record('WARNING', message, **kwargs)
+        self._create_log_record('WARNING', message, *args, **kwargs)
     
-    def error(self, message: str, **kwargs):
+    def error(self, message: str, *args, **kwargs):
         """Error level logging"""
-        self._create_log_record('ERROR', message, **kwargs)
+        self._create_log_record('ERROR', message, *args, **kwargs)
     
-    def critical(self, message: str, **kwargs):
+    def critical(self, message: str, *args, **kwargs):
         """Critical level logging"""
-        self._create_log_record('CRITICAL', message, **kwargs)
+        self._create_log_record('CRITICAL', message, *args, **kwargs)
+    
+    def exception(self, message: str, *args, **kwargs):
+        """Error level logging with the current exception traceback"""
+        kwargs.setdefault('exc_info', True)
+        self._create_log_record('ERROR', message, *args, **kwargs)
 
 # Global logger instance
 app_logger = AppLogger()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Data migration script for Le Maître Mot
+Creates the guest_quotas documents of guests whose exports were recorded before the
+collection existed, so the switch to guest_quotas doesn't reset their quota
+"""
+
+import asyncio
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from pathlib import Path
+from guest_quota import GUEST_EXPORT_QUOTA_WINDOW, GUEST_MAX_EXPORTS, GuestQuotaStore
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+async def migrate_guest_quotas():
+    """Seed guest quotas from the exports of the last 30 days"""
+    try:
+        # Connect to MongoDB
+        mongo_url = os.environ['MONGO_URL']
+        client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+
+        print("🔧 Seeding guest_quotas from recent exports for Le Maître Mot...")
+
+        store = GuestQuotaStore(db.guest_quotas, GUEST_MAX_EXPORTS, GUEST_EXPORT_QUOTA_WINDOW)
+        seeded = await store.seed_from_exports(db.exports)
+        if seeded:
+            print(f"✅ Created {seeded} guest quotas")
+        else:
+            print("No guest quota to create")
+
+        # Close connection
+        client.close()
+
+    except Exception as e:
+        print(f"❌ Error seeding guest quotas: {e}")
+        raise
+
+if __name__ == "__main__":
+    asyncio.run(migrate_guest_quotas())
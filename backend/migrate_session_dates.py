@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Data migration script for Le Maître Mot
+Converts login_sessions dates stored as ISO strings into BSON dates, so existing
+sessions keep validating and the expires_at TTL index can evict them
+"""
+
+import asyncio
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from dotenv import load_dotenv
+from pathlib import Path
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+SESSION_DATE_FIELDS = ("expires_at", "created_at", "last_used")
+
+def _to_date(field: str) -> dict:
+    # ISO strings without an offset were always written in UTC, which is also how
+    # $convert reads them; an unparsable or missing value is left as it was
+    return {"$convert": {"input": f"${field}", "to": "date", "onError": f"${field}", "onNull": f"${field}"}}
+
+async def normalize_session_dates(db) -> int:
+    """Rewrite string session dates as dates (idempotent), returns the number of fixed sessions"""
+    result = await db.login_sessions.update_many(
+        {"$or": [{field: {"$type": "string"}} for field in SESSION_DATE_FIELDS]},
+        [{"$set": {field: _to_date(field) for field in SESSION_DATE_FIELDS}}]
+    )
+    return result.modified_count
+
+async def migrate_session_dates():
+    """Normalize login session dates"""
+    try:
+        # Connect to MongoDB
+        mongo_url = os.environ['MONGO_URL']
+        client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+
+        print("🔧 Normalizing login_sessions dates for Le Maître Mot...")
+
+        fixed = await normalize_session_dates(db)
+        if fixed:
+            print(f"✅ Converted the dates of {fixed} login sessions")
+        else:
+            print("No string session dates found")
+
+        # Close connection
+        client.close()
+
+    except Exception as e:
+        print(f"❌ Error migrating login session dates: {e}")
+        raise
+
+if __name__ == "__main__":
+    asyncio.run(migrate_session_dates())
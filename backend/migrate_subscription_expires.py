@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Data migration script for Le Maître Mot
+Converts pro_users.subscription_expires values stored as ISO strings into BSON dates,
+so Pro-status checks can compare them directly
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from pathlib import Path
+
+# Load environment variables
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+def parse_expiry(value: str) -> datetime:
+    """Parse a stored ISO expiry; naive values were always written in UTC"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+async def normalize_subscription_expires(db) -> int:
+    """Rewrite string subscription_expires values as dates (idempotent), returns the number of fixed users"""
+    operations = []
+    async for user in db.pro_users.find(
+        {"subscription_expires": {"$type": "string"}},
+        {"_id": 1, "subscription_expires": 1}
+    ):
+        try:
+            expires = parse_expiry(user["subscription_expires"])
+        except ValueError:
+            continue
+        operations.append(UpdateOne({"_id": user["_id"]}, {"$set": {"subscription_expires": expires}}))
+
+    if operations:
+        await db.pro_users.bulk_write(operations, ordered=False)
+    return len(operations)
+
+async def migrate_subscription_expires():
+    """Normalize Pro subscription expiry dates"""
+    try:
+        # Connect to MongoDB
+        mongo_url = os.environ['MONGO_URL']
+        client = AsyncIOMotorClient(mongo_url, tz_aware=True)
+        db = client[os.environ['DB_NAME']]
+
+        print("🔧 Normalizing pro_users.subscription_expires for Le Maître Mot...")
+
+        fixed = await normalize_subscription_expires(db)
+        if fixed:
+            print(f"✅ Converted {fixed} subscription expiry values to dates")
+        else:
+            print("No string subscription expiry values found")
+
+        # Close connection
+        client.close()
+
+    except Exception as e:
+        print(f"❌ Error migrating subscription expiry dates: {e}")
+        raise
+
+if __name__ == "__main__":
+    asyncio.run(migrate_subscription_expires())
@@ -0,0 +1,183 @@
+"""
+PDF Renderer - Run WeasyPrint in worker processes so PDF exports don't block the event loop
+"""
+
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import weasyprint
+from cachetools import LRUCache
+from weasyprint.text.fonts import FontConfiguration
+
+
+# Stylesheet links can't be resolved: HTML is rendered from a string without base_url,
+# so WeasyPrint only spends time reporting them. Page styles are inline <style> blocks.
+_STYLESHEET_LINK_RE = re.compile(r'<link\b[^>]*\brel=["\']?stylesheet\b[^>]*>', re.IGNORECASE)
+
+
+def strip_stylesheet_links(html: str) -> str:
+    """Remove <link rel="stylesheet"> tags from an HTML document"""
+    return _STYLESHEET_LINK_RE.sub("", html)
+
+
+# Per-worker cache of fetched assets (logo files, remote images), bounded in bytes.
+# data: URIs are decoded inline by WeasyPrint's fetcher and not worth keeping.
+_ASSET_CACHE = LRUCache(maxsize=32 * 1024 * 1024, getsizeof=lambda asset: len(asset["string"]))
+
+
+def cached_url_fetcher(url: str, timeout: int = 10) -> dict:
+    """WeasyPrint url_fetcher that reuses assets fetched by earlier renders in this worker"""
+    if url.startswith("data:"):
+        return weasyprint.default_url_fetcher(url, timeout=timeout)
+
+    asset = _ASSET_CACHE.get(url)
+    if asset is None:
+        asset = weasyprint.default_url_fetcher(url, timeout=timeout)
+        file_obj = asset.pop("file_obj", None)
+        if file_obj is not None:
+            with file_obj:
+                asset["string"] = file_obj.read()
+        try:
+            _ASSET_CACHE[url] = asset
+        except ValueError:
+            # Larger than the whole cache
+            pass
+    return dict(asset)
+
+
+# <style> blocks of the document head. Templates only vary them by a few theme values,
+# so each distinct block is parsed once per worker (including its @import of web
+# fonts) and passed back to WeasyPrint as a stylesheet. Styles inside the body, such
+# as those embedded in inline SVG, are left in place.
+_HEAD_END_RE = re.compile(r'</head\s*>', re.IGNORECASE)
+_STYLE_BLOCK_RE = re.compile(r'<style\b[^>]*>(.*?)</style\s*>', re.IGNORECASE | re.DOTALL)
+_CSS_CACHE = LRUCache(maxsize=64)
+_font_config: Optional[FontConfiguration] = None
+
+
+def _get_font_config() -> FontConfiguration:
+    """Font configuration shared by every render of this worker, so web fonts
+    declared by cached stylesheets stay registered"""
+    global _font_config
+    if _font_config is None:
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def _parsed_css(css_text: str) -> weasyprint.CSS:
+    key = hashlib.sha256(css_text.encode('utf-8')).digest()
+    css = _CSS_CACHE.get(key)
+    if css is None:
+        css = weasyprint.CSS(string=css_text, font_config=_get_font_config(), url_fetcher=cached_url_fetcher)
+        _CSS_CACHE[key] = css
+    return css
+
+
+def extract_head_styles(html: str) -> tuple:
+    """Split the head's <style> blocks out of a document, returns (html, css_blocks)"""
+    head_end = _HEAD_END_RE.search(html)
+    if head_end is None:
+        return html, []
+    head = html[:head_end.start()]
+    css_blocks = _STYLE_BLOCK_RE.findall(head)
+    if not css_blocks:
+        return html, []
+    return _STYLE_BLOCK_RE.sub("", head) + html[head_end.start():], css_blocks
+
+
+def render_pdf(html: str) -> bytes:
+    """Render an HTML string to PDF bytes (executed inside a worker process)"""
+    # Passed stylesheets cascade after the document's own, in order, so moving every
+    # head <style> block keeps the same result
+    html, css_blocks = extract_head_styles(html)
+    stylesheets = [_parsed_css(css_text) for css_text in css_blocks]
+    return weasyprint.HTML(string=html, url_fetcher=cached_url_fetcher).write_pdf(
+        stylesheets=stylesheets,
+        font_config=_get_font_config()
+    )
+
+
+def warm_up_worker():
+    """Worker initializer: pay WeasyPrint's first-render cost (font discovery,
+    default stylesheets) before the first real export lands on this process"""
+    try:
+        render_pdf("<p>warm-up</p>")
+    except Exception:
+        # A failing warm-up must not kill the worker; the real render reports errors
+        pass
+
+
+class PDFRenderPool:
+    """Process pool dedicated to WeasyPrint rendering
+
+    Workers are recycled after a fixed number of renders to bound WeasyPrint's
+    memory growth, and each one is warmed up with a tiny render when it starts.
+    The pool is created lazily on first use.
+
+    Rendering is a pure function of the HTML, so finished PDFs are memoized by
+    the SHA-256 of their HTML in a byte-bounded LRU. Renders faster than
+    ``min_cache_seconds`` are not worth the memory and are not kept.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, max_tasks_per_child: int = 20,
+                 cache_max_bytes: int = 64 * 1024 * 1024, min_cache_seconds: float = 0.05):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_tasks_per_child = max_tasks_per_child
+        self.min_cache_seconds = min_cache_seconds
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._cache = LRUCache(maxsize=cache_max_bytes, getsizeof=len) if cache_max_bytes > 0 else None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=warm_up_worker,
+                max_tasks_per_child=self.max_tasks_per_child
+            )
+        return self._executor
+
+    async def render(self, html: str) -> bytes:
+        """Render HTML to PDF bytes in a worker process, reusing an identical earlier render"""
+        html = strip_stylesheet_links(html)
+        if self._cache is None:
+            return await self._render(html)
+
+        key = hashlib.sha256(html.encode('utf-8')).hexdigest()
+        pdf_bytes = self._cache.get(key)
+        if pdf_bytes is not None:
+            return pdf_bytes
+
+        started = time.perf_counter()
+        pdf_bytes = await self._render(html)
+        if time.perf_counter() - started >= self.min_cache_seconds:
+            try:
+                self._cache[key] = pdf_bytes
+            except ValueError:
+                # Larger than the whole cache
+                pass
+        return pdf_bytes
+
+    async def _render(self, html: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), render_pdf, html)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+# Global instance
+pdf_render_pool = PDFRenderPool(
+    max_workers=int(os.environ.get('PDF_RENDER_WORKERS', 0)) or None,
+    max_tasks_per_child=int(os.environ.get('PDF_RENDER_MAX_TASKS_PER_CHILD', 20)),
+    cache_max_bytes=int(os.environ.get('PDF_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+)
@@ -0,0 +1,273 @@
+"""
+Schema Reconciliation - Complete geometric schemas with what the statement says
+
+Points, coordinates, parallels (//), perpendiculars (⊥), lengths and right angles
+stated in the exercise text are merged into the schema produced by the AI.
+"""
+
+import re
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# Patterns used by reconcile_enonce_schema, compiled once at import
+# Individual letters with word boundaries, or consecutive letters (like "ABC", "ABCD")
+_POINT_TOKEN_RE = re.compile(r'\b[A-Z]\b|[A-Z]{2,}')
+# Coordinates like "A(0,3)", "B(-2, 4)", etc.
+_COORD_RE = re.compile(r'([A-Z])\s*\(\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\)')
+# Geometric relations stated in the text, as (kind, pattern) pairs
+_RELATION_PATTERNS = (
+    ("parallel", r'([A-Z]{2})\s*//\s*([A-Z]{2})'),  # AB // CD
+    ("parallel", r'([A-Z])\s*([A-Z])\s*//\s*([A-Z])\s*([A-Z])'),  # A B // C D
+    ("parallel", r'\(([A-Z])([A-Z])\)\s*//\s*\(([A-Z])([A-Z])\)'),  # (AB) // (CD)
+    ("perpendicular", r'([A-Z]{2})\s*⊥\s*([A-Z]{2})'),  # AB ⊥ CD
+    ("perpendicular", r'([A-Z])\s*([A-Z])\s*⊥\s*([A-Z])\s*([A-Z])'),  # A B ⊥ C D
+    ("perpendicular", r'\(([A-Z])([A-Z])\)\s*⊥\s*\(([A-Z])([A-Z])\)'),  # (AB) ⊥ (CD)
+    # Lengths like "AB = 5 cm", "longueur BC = 3", etc.
+    ("length", r'([A-Z]{2})\s*=\s*(\d+(?:\.\d+)?)\s*(?:cm|m)?'),  # AB = 5 cm
+    ("length", r'longueur\s+([A-Z]{2})\s*=\s*(\d+(?:\.\d+)?)'),   # longueur AB = 5
+    ("length", r'([A-Z])\s*([A-Z])\s*=\s*(\d+(?:\.\d+)?)\s*(?:cm|m)?'),  # A B = 5 cm
+    ("right_angle", r'angle\s+droit\s+en\s+([A-Z])'),  # angle droit en B
+    ("right_angle", r'rectangle\s+en\s+([A-Z])'),      # rectangle en B
+    ("right_angle", r'perpendiculaire\s+en\s+([A-Z])'), # perpendiculaire en B
+)
+
+def _compile_relations(patterns):
+    """Fuse the relation patterns into one regex scanned in a single pass
+    
+    Each pattern sits in a zero-width lookahead, so the scan tries every position:
+    - chained relations are all found ("AB // CD // EF" gives AB//CD and CD//EF),
+      where separate consuming passes stopped after the first pair;
+    - at a given position only the first matching pattern counts, so the spaced
+      and unspaced forms of one relation ("AB ⊥ BC") give a single entry, not one
+      per pattern.
+    Returns the regex and, per alternative group name, the relation kind and the
+    indexes of its capture groups.
+    """
+    alternatives = []
+    groups = {}
+    group_index = 0
+    for i, (kind, pattern) in enumerate(patterns):
+        name = f"r{i}"
+        inner_count = re.compile(pattern).groups
+        alternatives.append(f"(?=(?P<{name}>{pattern}))")
+        groups[name] = (kind, range(group_index + 2, group_index + 2 + inner_count))
+        group_index += 1 + inner_count
+    return re.compile("|".join(alternatives)), groups
+
+_RELATIONS_RE, _RELATION_GROUPS = _compile_relations(_RELATION_PATTERNS)
+# Every relation pattern contains one of these; most statements have none and skip the scan
+_RELATION_MARKERS = ("//", "⊥", "=", "droit", "rectangle", "perpendiculaire")
+
+def reconcile_enonce_schema(enonce: str, schema_data: dict) -> dict:
+    """
+    Réconcilie l'énoncé et le schéma : complète les labels depuis l'énoncé, 
+    détecte les symboles de parallèles (//) et perpendiculaires (⊥)
+    
+    Le schéma est enrichi en place : les appelants remplacent de toute façon le
+    schéma d'origine par le résultat, une copie serait donc inutile.
+    
+    Args:
+        enonce: Texte de l'énoncé de l'exercice
+        schema_data: Données du schéma géométrique
+    
+    Returns:
+        dict: Schéma enrichi avec les informations extraites de l'énoncé
+    """
+    if not enonce or not schema_data or not isinstance(schema_data, dict):
+        return schema_data or {}
+    
+    enriched_schema = schema_data
+    original_elements = len(schema_data.get("points", [])) + len(schema_data.get("segments", [])) + len(schema_data.get("angles", []))
+    warnings = []
+    
+    # Extract points mentioned in the text, as single letters or letter sequences
+    mentioned_points = set()
+    for token in _POINT_TOKEN_RE.findall(enonce):
+        mentioned_points.update(token)
+    
+    # Get existing points from schema
+    existing_points = set(enriched_schema.get("points", []))
+    
+    # Find missing points that are mentioned in text but not in schema
+    missing_in_schema = mentioned_points - existing_points
+    if missing_in_schema:
+        warnings.append(f"Points mentionnés dans l'énoncé mais absents du schéma: {sorted(missing_in_schema)}")
+        # Add missing points to schema, after the existing ones
+        enriched_schema.setdefault("points", []).extend(sorted(missing_in_schema))
+        
+        # Add automatic positions for missing points using intelligent placement
+        labels = enriched_schema.get("labels", {})
+        auto_positions = auto_place_points(enriched_schema, sorted(missing_in_schema))
+        
+        for point, coords in auto_positions.items():
+            if point not in labels:
+                labels[point] = coords
+                logger.warning(f"Point {point} ajouté automatiquement à {coords}")
+        
+        enriched_schema["labels"] = labels
+    
+    # Find points in schema but not mentioned in text
+    missing_in_text = existing_points - mentioned_points
+    if missing_in_text:
+        warnings.append(f"Points dans le schéma mais non mentionnés dans l'énoncé: {sorted(missing_in_text)}")
+    
+    # Extract coordinate information from text
+    text_coordinates = _COORD_RE.findall(enonce) if "(" in enonce else []
+    
+    if text_coordinates:
+        labels = enriched_schema.get("labels", {})
+        for point, x, y in text_coordinates:
+            coord_str = f"({x},{y})"
+            if point in labels and labels[point] != coord_str:
+                warnings.append(f"Coordonnées contradictoires pour {point}: énoncé={coord_str}, schéma={labels[point]}")
+            else:
+                labels[point] = coord_str
+                logger.info(f"Coordonnées extraites de l'énoncé: {point}{coord_str}")
+        
+        enriched_schema["labels"] = labels
+    
+    # Detect parallels (//), perpendiculars (⊥), lengths and right angles in one pass
+    detected_parallels = []
+    detected_perpendiculars = []
+    detected_lengths = {}
+    detected_right_angles = []
+    has_relations = any(marker in enonce for marker in _RELATION_MARKERS)
+    for relation in (_RELATIONS_RE.finditer(enonce) if has_relations else ()):
+        kind, group_indexes = _RELATION_GROUPS[relation.lastgroup]
+        match = relation.group(*group_indexes)
+        if kind == "right_angle":
+            detected_right_angles.append([match, {"angle_droit": True}])
+        elif kind == "length":
+            if len(match) == 2:  # Format: AB = 5
+                segment, length = match[0], match[1]
+                if len(segment) == 2:
+                    detected_lengths[segment] = float(length)
+            elif len(match) == 3:  # Format: A B = 5
+                p1, p2, length = match[0], match[1], match[2]
+                segment = p1 + p2
+                detected_lengths[segment] = float(length)
+        else:
+            detected = detected_parallels if kind == "parallel" else detected_perpendiculars
+            if len(match) == 2:  # Format: AB // CD
+                seg1, seg2 = match[0], match[1]
+                if len(seg1) == 2 and len(seg2) == 2:
+                    detected.append([[list(seg1), list(seg2)]])
+            elif len(match) == 4:  # Format: A B // C D
+                seg1 = [match[0], match[1]]
+                seg2 = [match[2], match[3]]
+                detected.append([[seg1, seg2]])
+    
+    if detected_parallels:
+        existing_parallels = enriched_schema.get("paralleles", [])
+        for parallel_pair in detected_parallels:
+            if parallel_pair not in existing_parallels:
+                existing_parallels.extend(parallel_pair)
+                logger.info(f"Parallèles détectées dans l'énoncé: {parallel_pair}")
+        enriched_schema["paralleles"] = existing_parallels
+    
+    if detected_perpendiculars:
+        existing_perpendiculars = enriched_schema.get("perpendiculaires", [])
+        for perp_pair in detected_perpendiculars:
+            if perp_pair not in existing_perpendiculars:
+                existing_perpendiculars.extend(perp_pair)
+                logger.info(f"Perpendiculaires détectées dans l'énoncé: {perp_pair}")
+        enriched_schema["perpendiculaires"] = existing_perpendiculars
+    
+    if detected_lengths:
+        segments = enriched_schema.get("segments", [])
+        # First segment with properties for each (p1, p2), as the renderers read them
+        segments_by_ends = {}
+        for segment in segments:
+            if len(segment) >= 3:
+                segments_by_ends.setdefault((segment[0], segment[1]), segment)
+        
+        for segment_name, length in detected_lengths.items():
+            p1, p2 = list(segment_name)
+            # Look for existing segment or add new one
+            segment = segments_by_ends.get((p1, p2))
+            if segment is not None:
+                segment[2]["longueur"] = length
+            else:
+                segment = [p1, p2, {"longueur": length}]
+                segments.append(segment)
+                segments_by_ends[(p1, p2)] = segment
+                logger.info(f"Longueur extraite de l'énoncé: {segment_name} = {length}")
+        
+        enriched_schema["segments"] = segments
+    
+    if detected_right_angles:
+        angles = enriched_schema.get("angles", [])
+        for right_angle in detected_right_angles:
+            if right_angle not in angles:
+                angles.append(right_angle)
+                logger.info(f"Angle droit détecté dans l'énoncé: {right_angle[0]}")
+        enriched_schema["angles"] = angles
+    
+    # Log warnings
+    if warnings:
+        for warning in warnings:
+            logger.warning(f"[reconcile_enonce_schema] {warning}")
+    
+    # Log summary of enrichment
+    enriched_elements = len(enriched_schema.get("points", [])) + len(enriched_schema.get("segments", [])) + len(enriched_schema.get("angles", []))
+    
+    if enriched_elements > original_elements:
+        logger.info(f"[reconcile_enonce_schema] Schéma enrichi par l'énoncé: {original_elements} → {enriched_elements} éléments")
+    
+    return enriched_schema
+
+def auto_place_points(schema: dict, missing_points: list) -> dict:
+    """
+    Intelligently place missing points based on schema type
+    
+    Args:
+        schema: Schema dictionary 
+        missing_points: List of point names to place
+    
+    Returns:
+        dict: Updated labels with auto-placed points
+    """
+    if not missing_points:
+        return {}
+    
+    schema_type = schema.get("type", "").lower()
+    auto_positions = {}
+    placed_count = 0
+    
+    # Rule 1: Triangle with 3 missing points
+    if schema_type in ["triangle", "triangle_rectangle"] and len(missing_points) == 3:
+        triangle_positions = {"A": (0, 0), "B": (8, 0), "C": (0, 6)}
+        for point in sorted(missing_points):
+            if placed_count < 3:
+                position_keys = list(triangle_positions.keys())
+                if placed_count < len(position_keys):
+                    pos = triangle_positions[position_keys[placed_count]]
+                    auto_positions[point] = f"({pos[0]},{pos[1]})"
+                    placed_count += 1
+    
+    # Rule 2: Quadrilaterals with 4 missing points
+    elif schema_type in ["rectangle", "carre", "losange", "parallelogramme", "trapeze", 
+                        "trapeze_rectangle", "trapeze_isocele", "quadrilatere"] and len(missing_points) == 4:
+        quad_positions = {"A": (0, 0), "B": (8, 0), "C": (8, 6), "D": (0, 6)}
+        for point in sorted(missing_points):
+            if placed_count < 4:
+                position_keys = list(quad_positions.keys())
+                if placed_count < len(position_keys):
+                    pos = quad_positions[position_keys[placed_count]]
+                    auto_positions[point] = f"({pos[0]},{pos[1]})"
+                    placed_count += 1
+    
+    # Rule 3: Distribute remaining points on circle of radius 5
+    if placed_count < len(missing_points):
+        remaining_points = missing_points[placed_count:]
+        circle_positions = [(5, 0), (0, 5), (-5, 0), (0, -5), (3.5, 3.5), (-3.5, 3.5), (-3.5, -3.5), (3.5, -3.5)]
+        
+        for i, point in enumerate(remaining_points):
+            if i < len(circle_positions):
+                x, y = circle_positions[i]
+                auto_positions[point] = f"({x},{y})"
+    
+    return auto_positions
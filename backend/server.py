@@ -1,29 +1,54 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Response, Depends, BackgroundTasks, Request, Form, UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, InsertOne, ReturnDocument, WriteConcern
+from pymongo.errors import DuplicateKeyError
 import os
-from logger import get_logger
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
 from typing import List, Optional, Dict
+from contextvars import ContextVar
 import uuid
+import asyncio
+import hashlib
+import random
+import secrets
+import base64
+import io
+import zlib
 from datetime import datetime, timezone, timedelta
+from functools import partial
+from urllib.parse import quote
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
-import json
+import orjson
 import re
-import tempfile
-import weasyprint
-from jinja2 import Template
+from jinja2 import Environment
 from latex_to_svg import latex_renderer
 from geometry_renderer import geometry_renderer
 from render_schema import schema_renderer
-import requests
+from pdf_renderer import pdf_render_pool
+from content_renderer import content_render_pool, render_content
+from schema_reconciliation import reconcile_enonce_schema
+from exercise_icons import EXERCISE_ICON_MAPPING, enrich_exercise_with_icon
+from db_batching import MongoBatcher, BulkInserter
+from guest_quota import GUEST_EXPORT_QUOTA_WINDOW, GUEST_MAX_EXPORTS, GuestQuotaStore
+from session_cache import SessionCache, create_redis_client
+import httpx
+from cachetools import LRUCache
+from PIL import Image
+from init_db_indexes import ensure_indexes
+from migrate_subscription_expires import normalize_subscription_expires
+from migrate_session_dates import normalize_session_dates
 from logger import get_logger, log_execution_time, log_ai_generation, log_schema_processing, log_user_context, log_quota_check
 
+# Configure logging once - handled by unified logger system
+logger = get_logger(__name__)
+
 ROOT_DIR = Path(__file__).parent
 TEMPLATES_DIR = ROOT_DIR / 'templates'
 load_dotenv(ROOT_DIR / '.env')
@@ -38,88 +63,131 @@ def load_template(template_name: str) -> str:
     with open(template_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-# Icon mapping for exercises - Professional cascading logic
-EXERCISE_ICON_MAPPING = {
-    # Priority 1: By exercise type (most robust)
-    "geometry": "triangle-ruler",
-    "algebra": "calculator",
-    "statistics": "bar-chart",
-    "probability": "dice-6",
-    "text": "file-text",
-    
-    # Priority 2: By chapter (fallback)
-    "Théorème de Pythagore": "triangle-ruler",
-    "Théorème de Thalès": "triangle-ruler", 
-    "Trigonométrie": "triangle-ruler",
-    "Géométrie": "triangle-ruler",
-    "Géométrie dans l'espace": "cube",
-    "Géométrie - Triangles et quadrilatères": "triangle-ruler",
-    "Fractions": "calculator",
-    "Équations": "calculator",
-    "Fonctions": "function-square",
-    "Statistiques": "bar-chart",
-    "Probabilités": "dice-6",
-    "Volumes": "cube",
-    
-    # Physics-Chemistry icons (future expansion)
-    "Matière": "atom",
-    "Énergie": "zap",
-    "Forces": "magnet",
-    
-    # Priority 3: Default fallback
-    "default": "book-open"
-}
+# Shared Jinja2 environment - templates are compiled once and reused across exports.
+# No autoescape: exercise content is pre-rendered HTML/SVG and was never escaped.
+_JINJA_ENV = Environment(auto_reload=False)
+_COMPILED_TEMPLATES = {}
 
-def enrich_exercise_with_icon(exercise_data: dict, chapitre: str) -> dict:
-    """
-    Professional cascading icon enrichment logic:
-    1. Priority: Use type from AI if provided and valid
-    2. Fallback: Use chapter-based mapping  
-    3. Detection: Analyze content for type hints
-    4. Default: Use generic icon
-    """
+def get_jinja_template(template_name: str):
+    """Return the compiled Jinja2 template for a templates/ file, compiling it on first use"""
+    template = _COMPILED_TEMPLATES.get(template_name)
+    if template is None:
+        template = _JINJA_ENV.from_string(load_template(template_name))
+        _COMPILED_TEMPLATES[template_name] = template
+    return template
+
+# Timezone-aware UTC clock, bound once
+_utcnow = partial(datetime.now, timezone.utc)
+
+# Timestamp of the HTTP request being handled, set by RequestTimestampMiddleware
+_REQUEST_NOW: ContextVar[Optional[datetime]] = ContextVar("request_now", default=None)
+
+def request_now() -> datetime:
+    """Timestamp of the current request, or the clock outside a request
     
-    # Priority 1: Use type from AI if provided and valid
-    ai_type = exercise_data.get("type", "").lower()
-    if ai_type in EXERCISE_ICON_MAPPING:
-        exercise_data["icone"] = EXERCISE_ICON_MAPPING[ai_type]
-        exercise_data["type"] = ai_type  # Ensure type is set
-        return exercise_data
+    Every model created while handling one request shares this timestamp.
+    """
+    return _REQUEST_NOW.get() or _utcnow()
+
+class RequestTimestampMiddleware:
+    """ASGI middleware reading the clock once per HTTP request for request_now()"""
     
-    # Priority 2: Use chapter-based mapping
-    if chapitre in EXERCISE_ICON_MAPPING:
-        exercise_data["icone"] = EXERCISE_ICON_MAPPING[chapitre]
-        # Infer type from chapter
-        if any(geo_word in chapitre.lower() for geo_word in ["géométrie", "pythagore", "thalès", "trigonométrie", "triangle", "volume"]):
-            exercise_data["type"] = "geometry"
-        elif any(alg_word in chapitre.lower() for alg_word in ["équation", "fonction", "fraction", "algèbre", "calcul"]):
-            exercise_data["type"] = "algebra"
-        elif any(stat_word in chapitre.lower() for stat_word in ["statistique", "probabilité"]):
-            exercise_data["type"] = "statistics"
-        else:
-            exercise_data["type"] = "text"
-        return exercise_data
+    def __init__(self, app):
+        self.app = app
     
-    # Priority 3: Content-based detection (for unknown chapters)
-    enonce = exercise_data.get("enonce", "").lower()
-    if any(geo_word in enonce for geo_word in ["triangle", "cercle", "carré", "rectangle", "géométrique", "angle", "côté", "volume", "aire"]):
-        exercise_data["type"] = "geometry"
-        exercise_data["icone"] = "triangle-ruler"
-    elif any(alg_word in enonce for alg_word in ["équation", "fonction", "fraction", "calcul", "nombre", "résoudre", "simplifier"]):
-        exercise_data["type"] = "algebra" 
-        exercise_data["icone"] = "calculator"
-    elif any(stat_word in enonce for stat_word in ["statistique", "moyenne", "graphique", "données", "probabilité", "hasard"]):
-        exercise_data["type"] = "statistics"
-        exercise_data["icone"] = "bar-chart"
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _REQUEST_NOW.set(_utcnow())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _REQUEST_NOW.reset(token)
+
+def as_utc(value) -> datetime:
+    """Normalize a stored date (aware/naive datetime or legacy ISO string) to aware UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+# HTTP caching helpers for polled endpoints
+POLLING_CACHE_CONTROL = "private, max-age=5"
+
+def compute_etag(*parts) -> str:
+    """Build a short strong ETag from the values that determine a response"""
+    raw = "|".join(str(part) for part in parts)
+    return '"' + hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest() + '"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check the If-None-Match header against an ETag"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def not_modified(etag: str, cache_control: str = POLLING_CACHE_CONTROL) -> Response:
+    """304 response carrying the caching headers"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+# Responses built from module constants only change on deploy
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+
+def static_json(payload) -> tuple:
+    """Serialize a constant response once, returns (body, etag)"""
+    body = orjson.dumps(payload)
+    return body, '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
+def static_json_response(request: Request, body: bytes, etag: str) -> Response:
+    """Serve a precomputed JSON body, or a 304 when the client already has it"""
+    if etag_matches(request, etag):
+        return not_modified(etag, STATIC_CACHE_CONTROL)
+    return Response(
+        content=body,
+        media_type="application/json",
+        headers={"ETag": etag, "Cache-Control": STATIC_CACHE_CONTROL}
+    )
+
+# PDF responses are streamed straight from memory in fixed-size chunks
+PDF_STREAM_CHUNK_SIZE = 64 * 1024
+
+async def _iter_pdf_chunks(pdf_bytes: bytes):
+    for offset in range(0, len(pdf_bytes), PDF_STREAM_CHUNK_SIZE):
+        yield pdf_bytes[offset:offset + PDF_STREAM_CHUNK_SIZE]
+
+def pdf_response(pdf_bytes: bytes, filename: str) -> StreamingResponse:
+    """Stream PDF bytes as a download, without going through a temporary file"""
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        content_disposition = f"attachment; filename*=utf-8''{quoted_filename}"
     else:
-        # Priority 4: Default fallback
-        exercise_data["type"] = "text"
-        exercise_data["icone"] = EXERCISE_ICON_MAPPING["default"]
+        content_disposition = f'attachment; filename="{filename}"'
     
-    return exercise_data
+    return StreamingResponse(
+        _iter_pdf_chunks(pdf_bytes),
+        media_type='application/pdf',
+        headers={
+            "Content-Disposition": content_disposition,
+            "Content-Length": str(len(pdf_bytes)),
+            # PDF streams are already compressed: an explicit encoding makes
+            # GZipMiddleware pass the download through untouched, Content-Length included
+            "Content-Encoding": "identity"
+        }
+    )
 
 # Removed duplicate sanitize_ai_response function - using the newer one below
 
+# Rendered schema images by SHA-256 of the canonical schema JSON. Regenerated and
+# varied exercises often carry the exact same schema.
+SCHEMA_BASE64_CACHE = LRUCache(maxsize=512)
+
+def schema_cache_key(schema: dict) -> str:
+    """Content hash of a schema, independent of key order"""
+    return hashlib.sha256(orjson.dumps(schema, option=orjson.OPT_SORT_KEYS, default=str)).hexdigest()
+
 # Professional content processing function
 @log_execution_time("process_schema_to_base64")
 def process_schema_to_base64(schema: Optional[dict]) -> Optional[str]:
@@ -133,6 +201,11 @@ def process_schema_to_base64(schema: Optional[dict]) -> Optional[str]:
         logger.debug("No schema provided or invalid schema format")
         return None
     
+    cache_key = schema_cache_key(schema)
+    cached_image = SCHEMA_BASE64_CACHE.get(cache_key)
+    if cached_image is not None:
+        return cached_image
+    
     schema_type = schema.get("type", "unknown")
     logger.debug(
         "Starting schema to Base64 conversion",
@@ -162,6 +235,7 @@ def process_schema_to_base64(schema: Optional[dict]) -> Optional[str]:
                 status="success"
             )
             log_schema_processing(schema_type, True)
+            SCHEMA_BASE64_CACHE[cache_key] = base64_image
             return base64_image
         else:
             logger.warning(
@@ -178,6 +252,22 @@ def process_schema_to_base64(schema: Optional[dict]) -> Optional[str]:
         logger.error(f"❌ Error processing schema to Base64: {e}")
         return None
 
+# Processed exercise content by raw content, bounded by the size of the rendered
+# HTML. Stock expressions and statements come back across generations and exports.
+# Very long contents are rarely repeated and are not kept.
+PROCESSED_CONTENT_CACHE = LRUCache(maxsize=32 * 1024 * 1024, getsizeof=len)
+PROCESSED_CONTENT_MAX_CACHED_LENGTH = 8192
+
+def _store_processed_content(raw_content: str, content: str, failed: bool):
+    # A partial result is returned but not kept, the next call retries
+    if failed or len(raw_content) >= PROCESSED_CONTENT_MAX_CACHED_LENGTH:
+        return
+    try:
+        PROCESSED_CONTENT_CACHE[raw_content] = content
+    except ValueError:
+        # Larger than the whole cache
+        pass
+
 def process_exercise_content(content: str) -> str:
     """
     Processes the exercise content to render both LaTeX and geometric schemas.
@@ -186,283 +276,110 @@ def process_exercise_content(content: str) -> str:
     if not content or not isinstance(content, str):
         return content if isinstance(content, str) else ""
     
-    # 1. Process legacy geometric schemas (for backward compatibility)
-    try:
-        content = geometry_renderer.process_geometric_schemas_for_web(content)
-    except Exception as e:
-        logger.error(f"Error processing legacy geometric schemas: {e}")
+    cached = PROCESSED_CONTENT_CACHE.get(content)
+    if cached is not None:
+        return cached
     
-    # 2. Process LaTeX formulas
-    try:
-        content = latex_renderer.convert_latex_to_svg(content)
-    except Exception as e:
-        logger.error(f"Error processing LaTeX: {e}")
-    
-    return content
+    processed, failed = render_content(content)
+    _store_processed_content(content, processed, failed)
+    return processed
 
-def reconcile_enonce_schema(enonce: str, schema_data: dict) -> dict:
-    """
-    Réconcilie l'énoncé et le schéma : complète les labels depuis l'énoncé, 
-    détecte les symboles de parallèles (//) et perpendiculaires (⊥)
+async def process_exercise_contents(contents: list) -> list:
+    """process_exercise_content for many contents, rendered in the content worker pool
     
-    Args:
-        enonce: Texte de l'énoncé de l'exercice
-        schema_data: Données du schéma géométrique
-    
-    Returns:
-        dict: Schéma enrichi avec les informations extraites de l'énoncé
+    Cached and duplicate contents are resolved in-process, only the rest is sent
+    to the workers.
     """
-    if not enonce or not schema_data or not isinstance(schema_data, dict):
-        return schema_data or {}
-    
-    enriched_schema = schema_data.copy()
-    warnings = []
-    
-    # Extract points mentioned in the text
-    # Pattern 1: Individual letters with word boundaries
-    points_pattern1 = r'\b([A-Z])\b'
-    # Pattern 2: Consecutive letters (like "ABC", "ABCD")
-    points_pattern2 = r'([A-Z]{2,})'
-    
-    mentioned_points = set(re.findall(points_pattern1, enonce))
-    
-    # Extract points from consecutive letter sequences
-    for sequence in re.findall(points_pattern2, enonce):
-        mentioned_points.update(list(sequence))
-    
-    # Get existing points from schema
-    existing_points = set(enriched_schema.get("points", []))
-    
-    # Find missing points that are mentioned in text but not in schema
-    missing_in_schema = mentioned_points - existing_points
-    if missing_in_schema:
-        warnings.append(f"Points mentionnés dans l'énoncé mais absents du schéma: {sorted(missing_in_schema)}")
-        # Add missing points to schema
-        enriched_schema["points"] = list(existing_points | missing_in_schema)
-        
-        # Add automatic positions for missing points using intelligent placement
-        labels = enriched_schema.get("labels", {})
-        auto_positions = auto_place_points(enriched_schema, list(missing_in_schema))
-        
-        for point, coords in auto_positions.items():
-            if point not in labels:
-                labels[point] = coords
-                logger.warning(f"Point {point} ajouté automatiquement à {coords}")
-        
-        enriched_schema["labels"] = labels
-    
-    # Find points in schema but not mentioned in text
-    missing_in_text = existing_points - mentioned_points
-    if missing_in_text:
-        warnings.append(f"Points dans le schéma mais non mentionnés dans l'énoncé: {sorted(missing_in_text)}")
-    
-    # Extract coordinate information from text
-    # Pattern for coordinates like "A(0,3)", "B(-2, 4)", etc.
-    coord_pattern = r'([A-Z])\s*\(\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\)'
-    text_coordinates = re.findall(coord_pattern, enonce)
-    
-    if text_coordinates:
-        labels = enriched_schema.get("labels", {})
-        for point, x, y in text_coordinates:
-            coord_str = f"({x},{y})"
-            if point in labels and labels[point] != coord_str:
-                warnings.append(f"Coordonnées contradictoires pour {point}: énoncé={coord_str}, schéma={labels[point]}")
-            else:
-                labels[point] = coord_str
-                logger.info(f"Coordonnées extraites de l'énoncé: {point}{coord_str}")
-        
-        enriched_schema["labels"] = labels
-    
-    # Detect parallel symbols (//) in text
-    parallel_patterns = [
-        r'([A-Z]{2})\s*//\s*([A-Z]{2})',  # AB // CD
-        r'([A-Z])\s*([A-Z])\s*//\s*([A-Z])\s*([A-Z])',  # A B // C D  
-        r'\(([A-Z])([A-Z])\)\s*//\s*\(([A-Z])([A-Z])\)',  # (AB) // (CD)
-    ]
-    
-    detected_parallels = []
-    for pattern in parallel_patterns:
-        matches = re.findall(pattern, enonce)
-        for match in matches:
-            if len(match) == 2:  # Format: AB // CD
-                seg1, seg2 = match[0], match[1]
-                if len(seg1) == 2 and len(seg2) == 2:
-                    detected_parallels.append([[list(seg1), list(seg2)]])
-            elif len(match) == 4:  # Format: A B // C D
-                seg1 = [match[0], match[1]]
-                seg2 = [match[2], match[3]]
-                detected_parallels.append([[seg1, seg2]])
-    
-    if detected_parallels:
-        existing_parallels = enriched_schema.get("paralleles", [])
-        for parallel_pair in detected_parallels:
-            if parallel_pair not in existing_parallels:
-                existing_parallels.extend(parallel_pair)
-                logger.info(f"Parallèles détectées dans l'énoncé: {parallel_pair}")
-        enriched_schema["paralleles"] = existing_parallels
-    
-    # Detect perpendicular symbols (⊥) in text
-    perpendicular_patterns = [
-        r'([A-Z]{2})\s*⊥\s*([A-Z]{2})',  # AB ⊥ CD
-        r'([A-Z])\s*([A-Z])\s*⊥\s*([A-Z])\s*([A-Z])',  # A B ⊥ C D
-        r'\(([A-Z])([A-Z])\)\s*⊥\s*\(([A-Z])([A-Z])\)',  # (AB) ⊥ (CD)
-    ]
-    
-    detected_perpendiculars = []
-    for pattern in perpendicular_patterns:
-        matches = re.findall(pattern, enonce)
-        for match in matches:
-            if len(match) == 2:  # Format: AB ⊥ CD
-                seg1, seg2 = match[0], match[1]
-                if len(seg1) == 2 and len(seg2) == 2:
-                    detected_perpendiculars.append([[list(seg1), list(seg2)]])
-            elif len(match) == 4:  # Format: A B ⊥ C D
-                seg1 = [match[0], match[1]]
-                seg2 = [match[2], match[3]]
-                detected_perpendiculars.append([[seg1, seg2]])
-    
-    if detected_perpendiculars:
-        existing_perpendiculars = enriched_schema.get("perpendiculaires", [])
-        for perp_pair in detected_perpendiculars:
-            if perp_pair not in existing_perpendiculars:
-                existing_perpendiculars.extend(perp_pair)
-                logger.info(f"Perpendiculaires détectées dans l'énoncé: {perp_pair}")
-        enriched_schema["perpendiculaires"] = existing_perpendiculars
-    
-    # Detect length information from text
-    # Pattern for lengths like "AB = 5 cm", "longueur BC = 3", etc.
-    length_patterns = [
-        r'([A-Z]{2})\s*=\s*(\d+(?:\.\d+)?)\s*(?:cm|m)?',  # AB = 5 cm
-        r'longueur\s+([A-Z]{2})\s*=\s*(\d+(?:\.\d+)?)',   # longueur AB = 5
-        r'([A-Z])\s*([A-Z])\s*=\s*(\d+(?:\.\d+)?)\s*(?:cm|m)?',  # A B = 5 cm
-    ]
-    
-    detected_lengths = {}
-    for pattern in length_patterns:
-        matches = re.findall(pattern, enonce)
-        for match in matches:
-            if len(match) == 2:  # Format: AB = 5
-                segment, length = match[0], match[1]
-                if len(segment) == 2:
-                    detected_lengths[segment] = float(length)
-            elif len(match) == 3:  # Format: A B = 5
-                p1, p2, length = match[0], match[1], match[2]
-                segment = p1 + p2
-                detected_lengths[segment] = float(length)
-    
-    if detected_lengths:
-        segments = enriched_schema.get("segments", [])
-        for segment_name, length in detected_lengths.items():
-            p1, p2 = list(segment_name)
-            # Look for existing segment or add new one
-            found = False
-            for segment in segments:
-                if len(segment) >= 3 and segment[0] == p1 and segment[1] == p2:
-                    segment[2]["longueur"] = length
-                    found = True
-                    break
-            
-            if not found:
-                segments.append([p1, p2, {"longueur": length}])
-                logger.info(f"Longueur extraite de l'énoncé: {segment_name} = {length}")
-        
-        enriched_schema["segments"] = segments
-    
-    # Detect right angles in text
-    right_angle_patterns = [
-        r'angle\s+droit\s+en\s+([A-Z])',  # angle droit en B
-        r'rectangle\s+en\s+([A-Z])',      # rectangle en B
-        r'perpendiculaire\s+en\s+([A-Z])', # perpendiculaire en B
-    ]
-    
-    detected_right_angles = []
-    for pattern in right_angle_patterns:
-        matches = re.findall(pattern, enonce)
-        for vertex in matches:
-            detected_right_angles.append([vertex, {"angle_droit": True}])
-    
-    if detected_right_angles:
-        angles = enriched_schema.get("angles", [])
-        for right_angle in detected_right_angles:
-            if right_angle not in angles:
-                angles.append(right_angle)
-                logger.info(f"Angle droit détecté dans l'énoncé: {right_angle[0]}")
-        enriched_schema["angles"] = angles
-    
-    # Log warnings
-    if warnings:
-        for warning in warnings:
-            logger.warning(f"[reconcile_enonce_schema] {warning}")
-    
-    # Log summary of enrichment
-    original_elements = len(schema_data.get("points", [])) + len(schema_data.get("segments", [])) + len(schema_data.get("angles", []))
-    enriched_elements = len(enriched_schema.get("points", [])) + len(enriched_schema.get("segments", [])) + len(enriched_schema.get("angles", []))
-    
-    if enriched_elements > original_elements:
-        logger.info(f"[reconcile_enonce_schema] Schéma enrichi par l'énoncé: {original_elements} → {enriched_elements} éléments")
+    results = [None] * len(contents)
+    pending = {}
+    for i, content in enumerate(contents):
+        if not content or not isinstance(content, str):
+            results[i] = content if isinstance(content, str) else ""
+            continue
+        cached = PROCESSED_CONTENT_CACHE.get(content)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.setdefault(content, []).append(i)
     
-    return enriched_schema
+    if pending:
+        rendered = await content_render_pool.render_many(list(pending))
+        for (content, indexes), (processed, failed) in zip(pending.items(), rendered):
+            _store_processed_content(content, processed, failed)
+            for i in indexes:
+                results[i] = processed
+    return results
 
-def auto_place_points(schema: dict, missing_points: list) -> dict:
-    """
-    Intelligently place missing points based on schema type
-    
-    Args:
-        schema: Schema dictionary 
-        missing_points: List of point names to place
-    
-    Returns:
-        dict: Updated labels with auto-placed points
-    """
-    if not missing_points:
-        return {}
-    
-    schema_type = schema.get("type", "").lower()
-    auto_positions = {}
-    placed_count = 0
-    
-    # Rule 1: Triangle with 3 missing points
-    if schema_type in ["triangle", "triangle_rectangle"] and len(missing_points) == 3:
-        triangle_positions = {"A": (0, 0), "B": (8, 0), "C": (0, 6)}
-        for point in sorted(missing_points):
-            if placed_count < 3:
-                position_keys = list(triangle_positions.keys())
-                if placed_count < len(position_keys):
-                    pos = triangle_positions[position_keys[placed_count]]
-                    auto_positions[point] = f"({pos[0]},{pos[1]})"
-                    placed_count += 1
-    
-    # Rule 2: Quadrilaterals with 4 missing points
-    elif schema_type in ["rectangle", "carre", "losange", "parallelogramme", "trapeze", 
-                        "trapeze_rectangle", "trapeze_isocele", "quadrilatere"] and len(missing_points) == 4:
-        quad_positions = {"A": (0, 0), "B": (8, 0), "C": (8, 6), "D": (0, 6)}
-        for point in sorted(missing_points):
-            if placed_count < 4:
-                position_keys = list(quad_positions.keys())
-                if placed_count < len(position_keys):
-                    pos = quad_positions[position_keys[placed_count]]
-                    auto_positions[point] = f"({pos[0]},{pos[1]})"
-                    placed_count += 1
+async def process_exercises_content(exercises: list):
+    """Process the statement and solution content of exercises in place"""
+    targets = []
+    for exercise in exercises:
+        if exercise.get('enonce'):
+            targets.append((exercise, 'enonce'))
+        solution = exercise.get('solution')
+        if solution:
+            if solution.get('resultat'):
+                targets.append((solution, 'resultat'))
+            if solution.get('etapes') and isinstance(solution['etapes'], list):
+                targets.extend((solution['etapes'], i) for i in range(len(solution['etapes'])))
     
-    # Rule 3: Distribute remaining points on circle of radius 5
-    if placed_count < len(missing_points):
-        remaining_points = missing_points[placed_count:]
-        circle_positions = [(5, 0), (0, 5), (-5, 0), (0, -5), (3.5, 3.5), (-3.5, 3.5), (-3.5, -3.5), (3.5, -3.5)]
-        
-        for i, point in enumerate(remaining_points):
-            if i < len(circle_positions):
-                x, y = circle_positions[i]
-                auto_positions[point] = f"({x},{y})"
-    
-    return auto_positions
+    processed = await process_exercise_contents([container[key] for container, key in targets])
+    for (container, key), content in zip(targets, processed):
+        container[key] = content
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Explicit pool sizing so webhook bursts and document endpoints don't queue on connection acquire
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+    minPoolSize=int(os.environ.get('MONGO_MIN_POOL_SIZE', 10)),
+    waitQueueTimeoutMS=2000,
+    maxIdleTimeMS=60000,
+    tz_aware=True  # Dates come back as aware UTC datetimes, comparable without normalization
+)
 db = client[os.environ['DB_NAME']]
 
+# Bookkeeping writes (last_used / last_login) don't wait for the journal: losing the
+# last few seconds of them on a crash is harmless. Session creation/deletion keep the default.
+FAST_WRITE_CONCERN = WriteConcern(w=1, j=False)
+login_sessions_fast = db.login_sessions.with_options(write_concern=FAST_WRITE_CONCERN)
+pro_users_fast = db.pro_users.with_options(write_concern=FAST_WRITE_CONCERN)
+
+# Shared outbound HTTP client (connection pooling + keep-alive across requests)
+http_client = httpx.AsyncClient(
+    timeout=15,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+)
+
+# Concurrent hot-path lookups are coalesced into one query per ~1ms window
+pro_user_batcher = MongoBatcher(db.pro_users, "email")
+# guest_quotas holds one document per guest with the exports of the rolling window
+guest_quota_batcher = MongoBatcher(db.guest_quotas, "guest_id", projection={"_id": 0, "guest_id": 1, "exports.at": 1})
+guest_quotas = GuestQuotaStore(db.guest_quotas, GUEST_MAX_EXPORTS, GUEST_EXPORT_QUOTA_WINDOW)
+# Concurrent inserts are grouped into one unordered bulk_write per ~5ms window
+exports_inserter = BulkInserter(db.exports)
+payment_transactions_inserter = BulkInserter(db.payment_transactions)
+
+# template_config entries exposed directly to the Pro export templates
+PRO_RENDER_CONTEXT_KEYS = ('school_name', 'professor_name', 'school_year', 'footer_text', 'logo_filename')
+
+# Fields of user_templates used to build an export's template_config
+TEMPLATE_CONFIG_PROJECTION = {
+    "_id": 0, "template_style": 1, "professor_name": 1, "school_name": 1,
+    "school_year": 1, "footer_text": 1, "logo_url": 1, "logo_filename": 1
+}
+
+async def record_export(export_record: dict):
+    """Store an export record; runs as a background task once the PDF has been sent"""
+    try:
+        await exports_inserter.insert(export_record)
+    except Exception as e:
+        logger.error(f"Error recording export {export_record.get('id')}: {e}")
+
 # Create the main app without a prefix
-app = FastAPI()
+# orjson for every JSON response
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Create uploads directory and mount static files
 uploads_dir = ROOT_DIR / "uploads"
@@ -478,6 +395,24 @@ emergent_key = os.environ.get('EMERGENT_LLM_KEY')
 # Initialize Stripe
 stripe_secret_key = os.environ.get('STRIPE_SECRET_KEY')
 
+# StripeCheckout clients by webhook URL (the URL only depends on the request host),
+# built on first use and reused across requests. Bounded since Host is client-supplied.
+_STRIPE_CHECKOUTS = LRUCache(maxsize=8)
+
+def get_stripe_checkout(webhook_url: str = "") -> StripeCheckout:
+    """Shared StripeCheckout client for a webhook URL"""
+    stripe_checkout = _STRIPE_CHECKOUTS.get(webhook_url)
+    if stripe_checkout is None:
+        stripe_checkout = StripeCheckout(api_key=stripe_secret_key, webhook_url=webhook_url)
+        _STRIPE_CHECKOUTS[webhook_url] = stripe_checkout
+    return stripe_checkout
+
+# Subscription length per package duration
+SUBSCRIPTION_DURATIONS = {
+    "monthly": timedelta(days=30),
+    "yearly": timedelta(days=365)
+}
+
 # Define pricing packages (server-side only for security)
 PRICING_PACKAGES = {
     "monthly": {
@@ -548,6 +483,17 @@ EXPORT_TEMPLATE_STYLES = {
     }
 }
 
+# Precompile every export template at import so no request pays the Jinja parse cost
+for _template_name in sorted(
+    {style[key] for style in EXPORT_TEMPLATE_STYLES.values() for key in ("sujet_template", "corrige_template")}
+    | {"sujet_pro", "corrige_pro"}
+):
+    try:
+        get_jinja_template(_template_name)
+    except Exception as e:
+        # Missing or broken templates keep failing at export time, as before
+        logger.warning(f"Could not precompile template {_template_name}: {e}")
+
 # Define Models
 class Exercise(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -579,7 +525,12 @@ class Document(BaseModel):
     nb_exercices: int
     exercises: List[Exercise] = []
     export_count: int = 0  # Track exports for quotas
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=request_now)
+
+def document_from_db(doc: dict) -> Document:
+    """Build a Document from our own stored data, skipping validation (extra keys are ignored)"""
+    exercises = [Exercise.model_construct(**exercise) for exercise in doc.get('exercises', [])]
+    return Document.model_construct(**{**doc, 'exercises': exercises})
 
 class ProUser(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -590,7 +541,7 @@ class ProUser(BaseModel):
     subscription_type: str  # "monthly" or "yearly"
     subscription_expires: datetime
     stripe_customer_id: Optional[str] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=request_now)
     last_login: Optional[datetime] = None
 
 class PaymentTransaction(BaseModel):
@@ -605,8 +556,8 @@ class PaymentTransaction(BaseModel):
     payment_status: str = "pending"  # pending, paid, failed, expired
     session_status: str = "initiated"  # initiated, complete, expired
     metadata: Optional[Dict] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=request_now)
+    updated_at: datetime = Field(default_factory=request_now)
 
 class LoginSession(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -614,8 +565,8 @@ class LoginSession(BaseModel):
     session_token: str
     device_id: str  # Unique identifier for device/browser
     expires_at: datetime
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    last_used: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=request_now)
+    last_used: datetime = Field(default_factory=request_now)
 
 class LoginRequest(BaseModel):
     email: EmailStr
@@ -635,8 +586,8 @@ class UserTemplate(BaseModel):
     footer_text: Optional[str] = None
     template_style: str = "minimaliste"  # minimaliste, classique, moderne
     colors: Optional[Dict] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=request_now)
+    updated_at: datetime = Field(default_factory=request_now)
 
 class GenerateRequest(BaseModel):
     matiere: str
@@ -699,6 +650,9 @@ class TemplateSaveRequest(BaseModel):
     footer_text: Optional[str] = None
     template_style: str = "minimaliste"
 
+class VaryExercisesRequest(BaseModel):
+    indices: List[int]
+
 # French curriculum data
 CURRICULUM_DATA = {
     "Mathématiques": {
@@ -849,6 +803,23 @@ TEMPLATE_STYLES = {
     }
 }
 
+# Colors and CSS font names resolved once per style for the WeasyPrint templates
+TEMPLATE_STYLE_RENDER_CONTEXT = {
+    style_name: {
+        'template_colors': {
+            'primary': style['primary_color'],
+            'secondary': style['secondary_color'],
+            'accent': style['accent_color']
+        },
+        'template_fonts': {
+            'header': style['header_font'].replace('-', ' '),
+            'content': style['content_font'].replace('-', ' ')
+        }
+    }
+    for style_name, style in TEMPLATE_STYLES.items()
+}
+_DEFAULT_STYLE_RENDER_CONTEXT = TEMPLATE_STYLE_RENDER_CONTEXT['minimaliste']
+
 # Advanced PDF Layout Options
 PDF_LAYOUT_OPTIONS = {
     "page_formats": {
@@ -1111,7 +1082,7 @@ PDF_LAYOUT_OPTIONS = {
 
 @log_execution_time("check_guest_quota")
 async def check_guest_quota(guest_id: str):
-    """Check if guest user can export (3 exports max)"""
+    """Check if guest user can export (GUEST_MAX_EXPORTS exports per 30 days)"""
     logger = get_logger()
     logger.debug(
         "Starting guest quota check",
@@ -1122,16 +1093,15 @@ async def check_guest_quota(guest_id: str):
     )
     
     try:
-        thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-        export_count = await db.exports.count_documents({
-            "guest_id": guest_id,
-            "created_at": {"$gte": thirty_days_ago}
-        })
+        # Exports in the last 30 days, batched with concurrent quota checks
+        quota = await guest_quota_batcher.get(guest_id)
+        cutoff = _utcnow() - GUEST_EXPORT_QUOTA_WINDOW
+        export_count = sum(1 for export in (quota or {}).get("exports", []) if as_utc(export["at"]) >= cutoff)
         
-        remaining = max(0, 3 - export_count)
+        remaining = max(0, GUEST_MAX_EXPORTS - export_count)
         
         # Log quota check result
-        log_quota_check("guest", export_count, 3, guest_id=guest_id[:8] + "..." if guest_id and len(guest_id) > 8 else guest_id)
+        log_quota_check("guest", export_count, GUEST_MAX_EXPORTS, guest_id=guest_id[:8] + "..." if guest_id and len(guest_id) > 8 else guest_id)
         
         logger.info(
             "Guest quota check completed",
@@ -1146,7 +1116,7 @@ async def check_guest_quota(guest_id: str):
         return {
             "exports_used": export_count,
             "exports_remaining": remaining,
-            "max_exports": 3,
+            "max_exports": GUEST_MAX_EXPORTS,
             "quota_exceeded": remaining == 0
         }
         
@@ -1154,37 +1124,146 @@ async def check_guest_quota(guest_id: str):
         logger.error(f"Error checking guest quota: {e}")
         return {
             "exports_used": 0,
-            "exports_remaining": 3,
-            "max_exports": 3,
+            "exports_remaining": GUEST_MAX_EXPORTS,
+            "max_exports": GUEST_MAX_EXPORTS,
             "quota_exceeded": False
         }
 
+# Session caches are keyed by session_key(token) so raw tokens are never kept in memory.
+# Entries are evicted on logout, when the user opens a new session elsewhere and when
+# the subscription changes. With REDIS_URL set they are shared by all workers, so
+# those evictions apply everywhere.
+SESSION_REDIS = create_redis_client()
+
+# Fields of the Pro user document kept in a shared cache entry
+PRO_SESSION_USER_FIELDS = ("email", "subscription_type", "subscription_expires", "last_login", "created_at")
+
+def _dump_pro_user(user) -> Optional[dict]:
+    return {field: user.get(field) for field in PRO_SESSION_USER_FIELDS} if user else None
+
+def _load_pro_user(user: Optional[dict]) -> Optional[dict]:
+    if user:
+        for field in ("subscription_expires", "last_login", "created_at"):
+            if user.get(field):
+                user[field] = as_utc(user[field])
+    return user
+
+def _dump_pro_status(status) -> str:
+    is_pro, user = status
+    return orjson.dumps([is_pro, _dump_pro_user(user)]).decode('utf-8')
+
+def _load_pro_status(raw: str):
+    is_pro, user = orjson.loads(raw)
+    return is_pro, _load_pro_user(user)
+
+def _dump_pro_session(resolved) -> str:
+    email, is_pro, user = resolved
+    return orjson.dumps([email, is_pro, _dump_pro_user(user)]).decode('utf-8')
+
+def _load_pro_session(raw: str):
+    email, is_pro, user = orjson.loads(raw)
+    return email, is_pro, _load_pro_user(user)
+
+# email -> (is_pro, user) as returned by check_user_pro_status. Evicted whenever
+# the Pro user document is written (login, subscription provisioning), on every
+# worker when REDIS_URL is set.
+PRO_STATUS_CACHE = SessionCache(
+    "pro_status", maxsize=5000, ttl=30, redis_client=SESSION_REDIS,
+    dumps=_dump_pro_status, loads=_load_pro_status
+)
+
 async def check_user_pro_status(email: str):
     """Check if user has active Pro subscription"""
+    cached = await PRO_STATUS_CACHE.get(email)
+    if cached is not None:
+        return cached
+    
     try:
-        user = await db.pro_users.find_one({"email": email})
-        if user and user.get("subscription_expires"):
-            expires = user["subscription_expires"]
-            if isinstance(expires, str):
-                expires = datetime.fromisoformat(expires).replace(tzinfo=timezone.utc)
-            elif isinstance(expires, datetime) and expires.tzinfo is None:
-                expires = expires.replace(tzinfo=timezone.utc)
-            
-            now = datetime.now(timezone.utc)
-            logger.info(f"Checking Pro status for {email}: expires={expires}, now={now}")
-            
-            if expires > now:
-                logger.info(f"User {email} is Pro (expires: {expires})")
-                return True, user
+        user = await pro_user_batcher.get(email)
+        # subscription_expires is stored as a BSON date (see create_pro_user_from_transaction)
+        # and read back tz-aware
+        expires = user.get("subscription_expires") if user else None
+        status = (False, None)
+        if expires:
+            if expires > _utcnow():
+                logger.info("User %s is Pro (expires: %s)", email, expires)
+                status = (True, user)
             else:
-                logger.info(f"User {email} Pro subscription expired")
+                logger.info("User %s Pro subscription expired", email)
         
-        return False, None
+        await PRO_STATUS_CACHE.set(email, email, status)
+        return status
         
     except Exception as e:
         logger.error(f"Error checking pro status: {e}")
         return False, None
 
+# session key -> email of a valid login session (before any Pro check), filled by
+# validate_session_token
+SESSION_EMAIL_CACHE = SessionCache("session_email", maxsize=10_000, ttl=60, redis_client=SESSION_REDIS)
+
+# session key -> (email, is_pro, user) as returned by resolve_session. Only Pro
+# sessions are cached, so a transient lookup error never sticks.
+PRO_SESSION_CACHE = SessionCache(
+    "pro_session", maxsize=10_000, ttl=30, redis_client=SESSION_REDIS,
+    dumps=_dump_pro_session, loads=_load_pro_session
+)
+
+# One in-flight resolution per session key, so a burst of requests on a cold
+# token issues a single pair of lookups. Entries are refcounted ([lock, users])
+# and dropped by the last user, so a waiter never ends up on an orphaned lock.
+_SESSION_LOCKS: Dict[str, list] = {}
+
+def session_key(session_token: str) -> str:
+    """Cache key for a session token"""
+    return hashlib.sha256(session_token.encode('utf-8')).hexdigest()[:32]
+
+async def invalidate_pro_session_cache(session_token: Optional[str] = None, email: Optional[str] = None):
+    """Drop cached sessions for a token and/or every token and the Pro status of an email"""
+    try:
+        if session_token:
+            key = session_key(session_token)
+            await SESSION_EMAIL_CACHE.delete(key)
+            await PRO_SESSION_CACHE.delete(key)
+        if email:
+            await SESSION_EMAIL_CACHE.delete_email(email)
+            await PRO_SESSION_CACHE.delete_email(email)
+            await PRO_STATUS_CACHE.delete(email)
+    except Exception as e:
+        logger.error(f"Error invalidating session cache: {e}")
+
+async def resolve_session(session_token: str):
+    """Resolve a session token to (email, is_pro, user)
+    
+    email is None when the session is invalid or expired.
+    """
+    key = session_key(session_token)
+    resolved = await PRO_SESSION_CACHE.get(key)
+    if resolved is not None:
+        return resolved
+    
+    entry = _SESSION_LOCKS.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            resolved = await PRO_SESSION_CACHE.get(key)
+            if resolved is not None:
+                return resolved
+            
+            email = await validate_session_token(session_token)
+            if not email:
+                return None, False, None
+            
+            is_pro, user = await check_user_pro_status(email)
+            resolved = (email, is_pro, user)
+            if is_pro:
+                await PRO_SESSION_CACHE.set(key, email, resolved)
+            return resolved
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _SESSION_LOCKS.pop(key, None)
+
 async def require_pro_user(request: Request):
     """Middleware to require Pro user authentication"""
     session_token = request.headers.get("X-Session-Token")
@@ -1195,14 +1274,13 @@ async def require_pro_user(request: Request):
             detail="Authentification requise pour les fonctionnalités Pro"
         )
     
-    email = await validate_session_token(session_token)
+    email, is_pro, _ = await resolve_session(session_token)
     if not email:
         raise HTTPException(
             status_code=401, 
             detail="Session invalide ou expirée"
         )
     
-    is_pro, user = await check_user_pro_status(email)
     if not is_pro:
         raise HTTPException(
             status_code=403, 
@@ -1227,23 +1305,8 @@ async def require_pro_user(request: Request):
 #     [COMMENTED OUT - ReportLab dependency removed]
 #     return None
 
-async def send_magic_link_email(email: str, token: str):
-    """Send magic link email via Brevo"""
-    try:
-        brevo_api_key = os.environ.get('BREVO_API_KEY')
-        sender_email = os.environ.get('BREVO_SENDER_EMAIL')
-        sender_name = os.environ.get('BREVO_SENDER_NAME', 'Le Maître Mot')
-        
-        if not brevo_api_key or not sender_email:
-            logger.error("Brevo credentials not configured")
-            return False
-        
-        # Generate magic link URL
-        frontend_url = os.environ.get('FRONTEND_URL', 'https://lemaitremot.preview.emergentagent.com')
-        magic_link = f"{frontend_url}/login/verify?token={token}"
-        
-        # Email content
-        html_content = f"""
+# Magic link email body, compiled once at import
+MAGIC_LINK_EMAIL_TEMPLATE = _JINJA_ENV.from_string("""
         <div style="font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;">
             <div style="background: linear-gradient(135deg, #3b82f6 0%, #6366f1 100%); padding: 2rem; text-align: center; border-radius: 8px 8px 0 0;">
                 <h1 style="color: white; margin: 0; font-size: 1.5rem;">Le Maître Mot</h1>
@@ -1258,7 +1321,7 @@ async def send_magic_link_email(email: str, token: str):
                 </p>
                 
                 <div style="text-align: center; margin: 2rem 0;">
-                    <a href="{magic_link}" 
+                    <a href="{{ magic_link }}" 
                        style="background: linear-gradient(135deg, #3b82f6 0%, #6366f1 100%); 
                               color: white;
                               text-decoration: none;
@@ -1289,11 +1352,27 @@ async def send_magic_link_email(email: str, token: str):
                 </div>
             </div>
         </div>
-        """
+        """)
+
+async def send_magic_link_email(email: str, token: str):
+    """Send magic link email via Brevo"""
+    try:
+        brevo_api_key = os.environ.get('BREVO_API_KEY')
+        sender_email = os.environ.get('BREVO_SENDER_EMAIL')
+        sender_name = os.environ.get('BREVO_SENDER_NAME', 'Le Maître Mot')
+        
+        if not brevo_api_key or not sender_email:
+            logger.error("Brevo credentials not configured")
+            return False
         
-        # Send email using requests (simple approach)
-        import requests
+        # Generate magic link URL
+        frontend_url = os.environ.get('FRONTEND_URL', 'https://lemaitremot.preview.emergentagent.com')
+        magic_link = f"{frontend_url}/login/verify?token={token}"
         
+        # Email content
+        html_content = MAGIC_LINK_EMAIL_TEMPLATE.render(magic_link=magic_link)
+        
+        # Send email through the shared async HTTP client
         headers = {
             'api-key': brevo_api_key,
             'Content-Type': 'application/json'
@@ -1314,7 +1393,7 @@ async def send_magic_link_email(email: str, token: str):
             'htmlContent': html_content
         }
         
-        response = requests.post(
+        response = await http_client.post(
             'https://api.brevo.com/v3/smtp/email',
             headers=headers,
             json=data,
@@ -1336,35 +1415,37 @@ async def create_login_session(email: str, device_id: str):
     """Create a new login session and invalidate old ones"""
     try:
         # Generate secure session token
-        session_token = str(uuid.uuid4()) + "-" + str(uuid.uuid4())
-        expires_at = datetime.now(timezone.utc) + timedelta(hours=24)
+        session_token = secrets.token_urlsafe(32)
+        now = _utcnow()
         
         # Create new session data
         session = LoginSession(
             user_email=email,
             session_token=session_token,
             device_id=device_id,
-            expires_at=expires_at
+            expires_at=now + timedelta(hours=24),
+            created_at=now,
+            last_used=now
         )
         
-        session_dict = session.dict()
-        session_dict['expires_at'] = session_dict['expires_at'].isoformat()
-        session_dict['created_at'] = session_dict['created_at'].isoformat()
-        session_dict['last_used'] = session_dict['last_used'].isoformat()
-        
-        # Remove all existing sessions for this user (single device policy)
-        delete_result = await db.login_sessions.delete_many({"user_email": email})
-        logger.info(f"Deleted {delete_result.deleted_count} existing sessions for {email}")
-        
-        # Insert the new session
-        await db.login_sessions.insert_one(session_dict)
-        logger.info(f"Created new session for {email} on device {device_id}")
-        
-        # Update user's last_login
-        await db.pro_users.update_one(
-            {"email": email},
-            {"$set": {"last_login": datetime.now(timezone.utc)}}
+        # Dates stay native BSON dates so the expires_at TTL index can evict the session
+        session_dict = session.model_dump()
+        
+        # Replace all existing sessions for this user (single device policy) in one
+        # ordered bulk_write, and update last_login concurrently
+        session_result, _ = await asyncio.gather(
+            db.login_sessions.bulk_write(
+                [DeleteMany({"user_email": email}), InsertOne(session_dict)],
+                ordered=True
+            ),
+            pro_users_fast.update_one(
+                {"email": email},
+                {"$set": {"last_login": session.created_at}}
+            )
         )
+        await invalidate_pro_session_cache(email=email)
+        logger.info(f"Deleted {session_result.deleted_count} existing sessions for {email}")
+        logger.info(f"Created new session for {email} on device {device_id}")
         
         logger.info(f"Login session created successfully for {email} - all previous sessions invalidated")
         return session_token
@@ -1375,33 +1456,27 @@ async def create_login_session(email: str, device_id: str):
 
 async def validate_session_token(session_token: str):
     """Validate a session token and return user email if valid"""
+    key = session_key(session_token)
+    cached_email = await SESSION_EMAIL_CACHE.get(key)
+    if cached_email:
+        return cached_email
+    
     try:
-        session = await db.login_sessions.find_one({"session_token": session_token})
+        # Expiry check and last_used bump in a single round-trip
+        now = _utcnow()
+        session = await login_sessions_fast.find_one_and_update(
+            {"session_token": session_token, "expires_at": {"$gt": now}},
+            {"$set": {"last_used": now}},
+            projection={"user_email": 1, "_id": 0}
+        )
         
         if not session:
             return None
-            
-        # Check expiration
-        expires_at = session.get('expires_at')
-        if isinstance(expires_at, str):
-            expires_at = datetime.fromisoformat(expires_at).replace(tzinfo=timezone.utc)
-        elif isinstance(expires_at, datetime) and expires_at.tzinfo is None:
-            expires_at = expires_at.replace(tzinfo=timezone.utc)
-            
-        now = datetime.now(timezone.utc)
-        
-        if expires_at < now:
-            # Session expired, clean it up
-            await db.login_sessions.delete_one({"session_token": session_token})
-            return None
-            
-        # Update last_used
-        await db.login_sessions.update_one(
-            {"session_token": session_token},
-            {"$set": {"last_used": datetime.now(timezone.utc)}}
-        )
         
-        return session.get('user_email')
+        email = session.get('user_email')
+        if email:
+            await SESSION_EMAIL_CACHE.set(key, email, email)
+        return email
         
     except Exception as e:
         logger.error(f"Error validating session token: {e}")
@@ -1437,7 +1512,7 @@ def sanitize_ai_response(response: str) -> str:
         
         # Validate JSON syntax
         try:
-            parsed = json.loads(json_content)
+            parsed = orjson.loads(json_content)
             
             # Ensure standard "schema" key (handle various formats)
             if "schéma" in parsed:
@@ -1469,9 +1544,9 @@ def sanitize_ai_response(response: str) -> str:
                         logger.info(f"Added fallback coordinates for points: {missing_coords}")
             
             # Return cleaned JSON
-            return json.dumps(parsed)
+            return orjson.dumps(parsed).decode()
             
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(
                 "Invalid JSON syntax in AI response after cleaning",
                 module_name="sanitize",
@@ -1564,7 +1639,6 @@ Réponds UNIQUEMENT avec ce JSON, rien d'autre.
         user_message = UserMessage(text=prompt)
         
         # Set shorter timeout for faster response
-        import asyncio
         response = await asyncio.wait_for(
             chat.send_message(user_message), 
             timeout=15.0  # 15 seconds max for schema generation
@@ -1575,7 +1649,7 @@ Réponds UNIQUEMENT avec ce JSON, rien d'autre.
         
         # Verify we have a valid schema
         try:
-            parsed = json.loads(sanitized_response)
+            parsed = orjson.loads(sanitized_response)
             if parsed.get("schema") is not None:
                 schema_type = parsed['schema'].get('type', 'unknown')
                 logger.info(
@@ -1590,7 +1664,7 @@ Réponds UNIQUEMENT avec ce JSON, rien d'autre.
                 logger.debug("No schema needed for this exercise")
                 
             return sanitized_response
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.warning(
                 "Failed to parse sanitized schema response",
                 module_name="schema",
@@ -1605,8 +1679,8 @@ Réponds UNIQUEMENT avec ce JSON, rien d'autre.
         return "{}"  # Return empty JSON object on error
 
 @log_execution_time("generate_exercises_with_ai")
-async def generate_exercises_with_ai(matiere: str, niveau: str, chapitre: str, type_doc: str, difficulte: str, nb_exercices: int) -> List[Exercise]:
-    """Generate exercises using AI"""
+async def _generate_exercise_batch_with_ai(matiere: str, niveau: str, chapitre: str, type_doc: str, difficulte: str, nb_exercices: int) -> List[Exercise]:
+    """Generate a batch of exercises with a single AI call (falls back to templates on failure)"""
     logger = get_logger()
     
     # Log input parameters
@@ -1840,7 +1914,6 @@ Types et icônes:
         logger.debug("Starting first AI pass - exercise content generation")
         log_ai_generation("first_pass_start", True)
         
-        import asyncio
         response = await asyncio.wait_for(
             chat.send_message(user_message), 
             timeout=20.0  # 20 seconds max
@@ -1855,7 +1928,7 @@ Types et icônes:
             raise ValueError("No JSON found in response")
             
         json_content = response[json_start:json_end]
-        data = json.loads(json_content)
+        data = orjson.loads(json_content)
         
         # Convert to Exercise objects with professional content processing
         exercises = []
@@ -1890,7 +1963,7 @@ Types et icônes:
                     if len(schema_json_str.strip()) > 10:  # More robust check for content
                         try:
                             # Validate the generated schema with STANDARDIZED format
-                            schema_data = json.loads(schema_json_str)
+                            schema_data = orjson.loads(schema_json_str)
                             schema_content = schema_data.get("schema")  # STANDARD KEY: "schema"
                             
                             if schema_content is not None and isinstance(schema_content, dict) and "type" in schema_content:
@@ -1917,7 +1990,7 @@ Types et icônes:
                                 logger.debug("No geometric schema needed for this exercise")
                                 log_ai_generation("second_pass_skip", True)
                                 
-                        except json.JSONDecodeError as e:
+                        except orjson.JSONDecodeError as e:
                             logger.warning(f"⚠️ Invalid JSON schema generated: {e}, keeping text-only exercise")
             
             # CRITICAL FIX: Clean the enonce by removing any residual JSON schema blocks
@@ -1985,7 +2058,7 @@ Types et icônes:
                 difficulte=ex_data.get("difficulte", difficulte),
                 solution=solution,
                 bareme=ex_data.get("bareme", [{"etape": "Méthode", "points": 2.0}, {"etape": "Résultat", "points": 2.0}]),
-                seed=hash(processed_enonce) % 1000000,
+                seed=zlib.crc32(processed_enonce.encode("utf-8")) % 1000000,
                 # Add icon and exercise type information
                 exercise_type=ex_data.get("type", "text"),
                 icone=ex_data.get("icone", EXERCISE_ICON_MAPPING["default"]),
@@ -2016,6 +2089,29 @@ Types et icônes:
         logger.error(f"Error generating exercises: {e}")
         return await generate_fallback_exercises(matiere, niveau, chapitre, difficulte, nb_exercices)
 
+# Exercises requested per AI call; larger documents are generated as parallel batches
+AI_GENERATION_BATCH_SIZE = 3
+
+async def generate_exercises_with_ai(matiere: str, niveau: str, chapitre: str, type_doc: str, difficulte: str, nb_exercices: int) -> List[Exercise]:
+    """Generate exercises using AI
+    
+    LLM latency grows with the length of the answer, so more than
+    AI_GENERATION_BATCH_SIZE exercises are split into concurrent smaller calls.
+    """
+    if nb_exercices <= AI_GENERATION_BATCH_SIZE:
+        return await _generate_exercise_batch_with_ai(matiere, niveau, chapitre, type_doc, difficulte, nb_exercices)
+    
+    batch_sizes = [
+        min(AI_GENERATION_BATCH_SIZE, nb_exercices - start)
+        for start in range(0, nb_exercices, AI_GENERATION_BATCH_SIZE)
+    ]
+    batches = await asyncio.gather(*[
+        _generate_exercise_batch_with_ai(matiere, niveau, chapitre, type_doc, difficulte, size)
+        for size in batch_sizes
+    ])
+    exercises = [exercise for batch in batches for exercise in batch]
+    return exercises[:nb_exercices]
+
 async def generate_fallback_exercises(matiere: str, niveau: str, chapitre: str, difficulte: str, nb_exercices: int) -> List[Exercise]:
     """Generate quick fallback exercises"""
     exercises = []
@@ -2112,7 +2208,6 @@ async def generate_fallback_exercises(matiere: str, niveau: str, chapitre: str,
         template = template_list[i % len(template_list)]
         
         # Simple random values
-        import random
         a, b, c = random.randint(2, 9), random.randint(2, 9), random.randint(2, 9)
         
         enonce = template.format(a=a, b=b, c=c)
@@ -2231,23 +2326,6 @@ def format_solutions_for_export(exercises: List[dict], options: AdvancedPDFOptio
     
     return "\n\n".join(formatted_content)
 
-def get_template_colors_and_fonts(template_config: dict) -> dict:
-    """Get template colors and fonts based on style"""
-    style_name = template_config.get('template_style', 'minimaliste')
-    template_style = TEMPLATE_STYLES.get(style_name, TEMPLATE_STYLES['minimaliste'])
-    
-    return {
-        'template_colors': {
-            'primary': template_style['primary_color'],
-            'secondary': template_style['secondary_color'],
-            'accent': template_style['accent_color']
-        },
-        'template_fonts': {
-            'header': template_style['header_font'],
-            'content': template_style['content_font']
-        }
-    }
-
 async def generate_advanced_pdf(document: dict, content: str, export_type: str, template_config: dict, options: AdvancedPDFOptions) -> bytes:
     """Generate PDF with advanced layout options"""
     # Get layout settings
@@ -2282,15 +2360,14 @@ async def generate_advanced_pdf(document: dict, content: str, export_type: str,
     
     # Use Pro template if available
     if template_config:
-        template_style = TEMPLATE_STYLES.get(template_config.get('template_style', 'minimaliste'), TEMPLATE_STYLES['minimaliste'])
         template_colors = get_template_colors_and_fonts(template_config)
         
         if export_type == "sujet":
-            template_content = load_template("sujet_pro")
+            template = get_jinja_template("sujet_pro")
         else:
-            template_content = load_template("corrige_pro")
+            template = get_jinja_template("corrige_pro")
         
-        html_content = Template(template_content).render(
+        html_content = template.render(
             document={
                 **document,
                 'exercices': content,
@@ -2328,8 +2405,8 @@ async def generate_advanced_pdf(document: dict, content: str, export_type: str,
         </html>
         """
     
-    # Generate PDF
-    pdf_bytes = weasyprint.HTML(string=html_content).write_pdf()
+    # Generate PDF in a worker process
+    pdf_bytes = await pdf_render_pool.render(html_content)
     return pdf_bytes
 
 # API Routes
@@ -2337,27 +2414,30 @@ async def generate_advanced_pdf(document: dict, content: str, export_type: str,
 async def root():
     return {"message": "API Le Maître Mot V1 - Générateur de documents pédagogiques"}
 
+CATALOG_JSON, CATALOG_ETAG = static_json({
+    "catalog": [
+        {
+            "name": matiere,
+            "levels": [
+                {"name": niveau, "chapters": chapitres}
+                for niveau, chapitres in niveaux.items()
+            ]
+        }
+        for matiere, niveaux in CURRICULUM_DATA.items()
+    ]
+})
+
 @api_router.get("/catalog")
-async def get_catalog():
+async def get_catalog(request: Request):
     """Get the curriculum catalog"""
-    catalog = []
-    for matiere, niveaux in CURRICULUM_DATA.items():
-        levels = []
-        for niveau, chapitres in niveaux.items():
-            levels.append({
-                "name": niveau,
-                "chapters": chapitres
-            })
-        catalog.append({
-            "name": matiere,
-            "levels": levels
-        })
-    return {"catalog": catalog}
+    return static_json_response(request, CATALOG_JSON, CATALOG_ETAG)
+
+PRICING_JSON, PRICING_ETAG = static_json({"packages": PRICING_PACKAGES})
 
 @api_router.get("/pricing")
-async def get_pricing():
+async def get_pricing(request: Request):
     """Get pricing packages"""
-    return {"packages": PRICING_PACKAGES}
+    return static_json_response(request, PRICING_JSON, PRICING_ETAG)
 
 @api_router.get("/analytics/overview")
 async def get_analytics_overview(request: Request):
@@ -2499,8 +2579,8 @@ async def get_usage_analytics(request: Request, days: int = 30):
         return {
             "usage_analytics": {
                 "period": {
-                    "start_date": start_date.isoformat(),
-                    "end_date": end_date.isoformat(),
+                    "start_date": start_date,
+                    "end_date": end_date,
                     "days": days
                 },
                 "daily_activity": {
@@ -2567,10 +2647,7 @@ async def generate_document(request: GenerateRequest):
         )
         
         # Save to database
-        doc_dict = document.dict()
-        # Convert datetime for MongoDB
-        doc_dict['created_at'] = doc_dict['created_at'].isoformat()
-        await db.documents.insert_one(doc_dict)
+        await db.documents.insert_one(document.model_dump())
         
         # Return the document (already processed during generation)
         return {"document": document}
@@ -2596,8 +2673,9 @@ async def request_login(request: LoginRequest):
             )
         
         # Generate magic link token (short-lived, 15 minutes)
-        magic_token = str(uuid.uuid4()) + "-magic-" + str(int(datetime.now(timezone.utc).timestamp()))
-        expires_at = datetime.now(timezone.utc) + timedelta(minutes=15)
+        now = _utcnow()
+        magic_token = secrets.token_urlsafe(24)
+        expires_at = now + timedelta(minutes=15)
         
         # Store magic token temporarily
         await db.magic_tokens.insert_one({
@@ -2605,7 +2683,7 @@ async def request_login(request: LoginRequest):
             "email": request.email,
             "expires_at": expires_at,
             "used": False,
-            "created_at": datetime.now(timezone.utc)
+            "created_at": now
         })
         
         # Send magic link email
@@ -2637,45 +2715,36 @@ async def verify_login(request: VerifyLoginRequest):
     try:
         logger.info(f"Attempting to verify login with token: {request.token[:20]}...")
         
-        # Find magic token
-        magic_token_doc = await db.magic_tokens.find_one({
-            "token": request.token,
-            "used": False
-        })
+        # Find magic token (one lookup tells missing and already used tokens apart)
+        magic_token_doc = await db.magic_tokens.find_one(
+            {"token": request.token},
+            projection={"used": 1, "expires_at": 1, "email": 1, "_id": 0}
+        )
         
         if not magic_token_doc:
-            logger.warning(f"Magic token not found or already used: {request.token[:20]}...")
-            
-            # Check if token exists but is used
-            used_token = await db.magic_tokens.find_one({"token": request.token})
-            if used_token:
-                logger.info("Token exists but is already used")
-                raise HTTPException(
-                    status_code=400,
-                    detail="Token déjà utilisé"
-                )
-            else:
-                logger.info("Token does not exist in database")
-                raise HTTPException(
-                    status_code=400,
-                    detail="Token invalide"
-                )
+            logger.warning(f"Magic token not found: {request.token[:20]}...")
+            logger.info("Token does not exist in database")
+            raise HTTPException(
+                status_code=400,
+                detail="Token invalide"
+            )
+        
+        if magic_token_doc.get('used'):
+            logger.warning(f"Magic token already used: {request.token[:20]}...")
+            logger.info("Token exists but is already used")
+            raise HTTPException(
+                status_code=400,
+                detail="Token déjà utilisé"
+            )
         
         logger.info(f"Magic token found for email: {magic_token_doc.get('email')}")
         
-        # Check token expiration
+        # Check token expiration (the TTL index deletes expired tokens shortly after)
         expires_at = magic_token_doc.get('expires_at')
-        if isinstance(expires_at, str):
-            expires_at = datetime.fromisoformat(expires_at).replace(tzinfo=timezone.utc)
-        elif isinstance(expires_at, datetime) and expires_at.tzinfo is None:
-            expires_at = expires_at.replace(tzinfo=timezone.utc)
-            
-        now = datetime.now(timezone.utc)
+        now = _utcnow()
         
         if expires_at < now:
             logger.warning(f"Token expired: expires_at={expires_at}, now={now}")
-            # Token expired
-            await db.magic_tokens.delete_one({"token": request.token})
             raise HTTPException(
                 status_code=400,
                 detail="Token expiré"
@@ -2698,7 +2767,7 @@ async def verify_login(request: VerifyLoginRequest):
         # Mark token as used
         await db.magic_tokens.update_one(
             {"token": request.token},
-            {"$set": {"used": True, "used_at": datetime.now(timezone.utc)}}
+            {"$set": {"used": True, "used_at": now}}
         )
         logger.info(f"Magic token marked as used for {email}")
         
@@ -2744,6 +2813,7 @@ async def logout(request: Request):
             )
         
         # Remove session
+        await invalidate_pro_session_cache(session_token=session_token)
         result = await db.login_sessions.delete_one({"session_token": session_token})
         
         if result.deleted_count == 0:
@@ -2778,22 +2848,18 @@ async def get_subscription_status(email: str):
         subscription_expires = user.get("subscription_expires")
         subscription_type = user.get("subscription_type", "inconnu")
         
+        now = _utcnow()
+        
         # Format dates
-        if isinstance(subscription_expires, str):
-            expires_date = datetime.fromisoformat(subscription_expires).replace(tzinfo=timezone.utc)
-        elif isinstance(subscription_expires, datetime):
-            expires_date = subscription_expires.replace(tzinfo=timezone.utc) if subscription_expires.tzinfo is None else subscription_expires
-        else:
-            expires_date = datetime.now(timezone.utc)
+        expires_date = as_utc(subscription_expires) if subscription_expires else now
         
-        now = datetime.now(timezone.utc)
         days_remaining = (expires_date - now).days
         
         return {
             "is_pro": True,
             "email": email,
             "subscription_type": subscription_type,
-            "subscription_expires": expires_date.isoformat(),
+            "subscription_expires": expires_date,
             "expires_date_formatted": expires_date.strftime("%d/%m/%Y"),
             "days_remaining": max(0, days_remaining),
             "is_active": expires_date > now,
@@ -2805,23 +2871,25 @@ async def get_subscription_status(email: str):
         logger.error(f"Error getting subscription status for {email}: {e}")
         raise HTTPException(status_code=500, detail="Erreur lors de la vérification du statut d'abonnement")
 
-@api_router.get("/template/styles")
-async def get_template_styles():
-    """Get available template styles (public endpoint)"""
-    return {
-        "styles": {
-            style_id: {
-                "name": style["name"],
-                "description": style["description"],
-                "preview_colors": {
-                    "primary": style["primary_color"],
-                    "secondary": style["secondary_color"], 
-                    "accent": style["accent_color"]
-                }
+TEMPLATE_STYLES_JSON, TEMPLATE_STYLES_ETAG = static_json({
+    "styles": {
+        style_id: {
+            "name": style["name"],
+            "description": style["description"],
+            "preview_colors": {
+                "primary": style["primary_color"],
+                "secondary": style["secondary_color"], 
+                "accent": style["accent_color"]
             }
-            for style_id, style in TEMPLATE_STYLES.items()
         }
+        for style_id, style in TEMPLATE_STYLES.items()
     }
+})
+
+@api_router.get("/template/styles")
+async def get_template_styles(request: Request):
+    """Get available template styles (public endpoint)"""
+    return static_json_response(request, TEMPLATE_STYLES_JSON, TEMPLATE_STYLES_ETAG)
 
 @api_router.get("/export/styles")
 async def get_export_styles(request: Request):
@@ -2832,9 +2900,7 @@ async def get_export_styles(request: Request):
         is_pro = False
         
         if session_token:
-            email = await validate_session_token(session_token)
-            if email:
-                is_pro, _ = await check_user_pro_status(email)
+            _, is_pro, _ = await resolve_session(session_token)
         
         # Filter styles based on user status
         available_styles = {}
@@ -2939,7 +3005,6 @@ async def save_user_template(
             uploads_dir.mkdir(parents=True, exist_ok=True)
             
             # Generate unique filename
-            import uuid
             file_extension = logo.filename.split('.')[-1].lower()
             logo_filename = f"logo_{user_email.replace('@', '_').replace('.', '_')}_{uuid.uuid4().hex[:8]}.{file_extension}"
             logo_path = uploads_dir / logo_filename
@@ -2999,14 +3064,15 @@ async def save_user_template(
                 logo_filename=logo_filename
             )
             
-            logger.info(f"🔍 Creating new template: {template.dict()}")
+            template_dict = template.model_dump()
+            logger.info(f"🔍 Creating new template: {template_dict}")
             
-            await db.user_templates.insert_one(template.dict())
+            await db.user_templates.insert_one(template_dict)
         
         logger.info(f"Template saved for user: {user_email}")
         return {
             "message": "Template sauvegardé avec succès",
-            "template": template.dict()
+            "template": template.model_dump()
         }
         
     except HTTPException:
@@ -3098,7 +3164,7 @@ async def validate_session(request: Request):
                 detail="Token de session manquant"
             )
         
-        email = await validate_session_token(session_token)
+        email, is_pro, user = await resolve_session(session_token)
         
         if not email:
             raise HTTPException(
@@ -3107,10 +3173,9 @@ async def validate_session(request: Request):
             )
         
         # Check if user is still Pro
-        is_pro, user = await check_user_pro_status(email)
-        
         if not is_pro:
             # Clean up session if user is no longer Pro
+            await invalidate_pro_session_cache(session_token=session_token)
             await db.login_sessions.delete_one({"session_token": session_token})
             raise HTTPException(
                 status_code=403,
@@ -3138,26 +3203,45 @@ async def check_quota_status(guest_id: str):
 
 def get_template_colors_and_fonts(template_config):
     """Get CSS colors and fonts for WeasyPrint templates based on template configuration"""
-    style_name = template_config.get('template_style', 'minimaliste')
-    template_style = TEMPLATE_STYLES.get(style_name, TEMPLATE_STYLES['minimaliste'])
-    
-    return {
-        'template_colors': {
-            'primary': template_style['primary_color'],
-            'secondary': template_style['secondary_color'],
-            'accent': template_style['accent_color']
-        },
-        'template_fonts': {
-            'header': template_style['header_font'].replace('-', ' '),
-            'content': template_style['content_font'].replace('-', ' ')
-        }
-    }
+    # Precomputed at import - treat as read-only
+    return TEMPLATE_STYLE_RENDER_CONTEXT.get(template_config.get('template_style'), _DEFAULT_STYLE_RENDER_CONTEXT)
+
+# Uploaded logos (up to 5 MB) are displayed at most ~70px high in the templates:
+# embed a downscaled PNG so WeasyPrint doesn't decode the original on every export
+LOGO_MAX_PIXEL_HEIGHT = 280
+_LOGO_CACHE = LRUCache(maxsize=128)
+
+def _build_logo_data_uri(path: str, max_height: int) -> str:
+    """Decode, downscale and re-encode a logo as a PNG data URI"""
+    with Image.open(path) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGBA")
+        img.thumbnail((max_height * 4, max_height))
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG", optimize=True)
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+async def get_logo_src(logo_file_path: Path) -> str:
+    """Image source for a logo file, cached by path + mtime + size"""
+    key = (str(logo_file_path), logo_file_path.stat().st_mtime_ns, LOGO_MAX_PIXEL_HEIGHT)
+    data_uri = _LOGO_CACHE.get(key)
+    if data_uri is None:
+        try:
+            # Cold miss: decode off the event loop
+            data_uri = await asyncio.to_thread(_build_logo_data_uri, key[0], LOGO_MAX_PIXEL_HEIGHT)
+        except Exception as e:
+            logger.warning(f"Could not downscale logo {logo_file_path}: {e}")
+            return f"file://{logo_file_path}"
+        _LOGO_CACHE[key] = data_uri
+    return data_uri
 
 @api_router.post("/export")
 @log_execution_time("export_pdf")
-async def export_pdf(request: ExportRequest, http_request: Request):
+async def export_pdf(request: ExportRequest, http_request: Request, background_tasks: BackgroundTasks):
     """Export document as PDF using unified WeasyPrint approach"""
     logger = get_logger()
+    quota_reservation = None
     
     logger.info(
         "Starting PDF export",
@@ -3178,10 +3262,9 @@ async def export_pdf(request: ExportRequest, http_request: Request):
         # Authenticate using session token only
         if session_token:
             logger.info(f"Session token provided: {session_token[:20]}...")
-            email = await validate_session_token(session_token)
+            email, is_pro, user = await resolve_session(session_token)
             if email:
                 logger.info(f"Session token validated for email: {email}")
-                is_pro, user = await check_user_pro_status(email)
                 is_pro_user = is_pro
                 user_email = email
                 logger.info(f"Pro status check result - email: {email}, is_pro: {is_pro}")
@@ -3190,7 +3273,7 @@ async def export_pdf(request: ExportRequest, http_request: Request):
                 if is_pro:
                     logger.info(f"Loading template config for Pro user: {email}")
                     try:
-                        template_doc = await db.user_templates.find_one({"user_email": email})
+                        template_doc = await db.user_templates.find_one({"user_email": email}, TEMPLATE_CONFIG_PROJECTION)
                         logger.info(f"🔍 Raw template doc from DB: {template_doc}")
                         if template_doc:
                             template_config = {
@@ -3232,12 +3315,12 @@ async def export_pdf(request: ExportRequest, http_request: Request):
             if not request.guest_id:
                 raise HTTPException(status_code=400, detail="Guest ID required for non-Pro users")
                 
-            quota_status = await check_guest_quota(request.guest_id)
+            quota_reservation = await guest_quotas.reserve(request.guest_id)
             
-            if quota_status["quota_exceeded"]:
+            if quota_reservation is None:
                 raise HTTPException(status_code=402, detail={
                     "error": "quota_exceeded", 
-                    "message": "Limite de 3 exports gratuits atteinte. Passez à l'abonnement Pro pour continuer.",
+                    "message": f"Limite de {GUEST_MAX_EXPORTS} exports gratuits atteinte. Passez à l'abonnement Pro pour continuer.",
                     "action": "upgrade_required"
                 })
         
@@ -3249,10 +3332,8 @@ async def export_pdf(request: ExportRequest, http_request: Request):
         # CRITICAL: Process geometric schemas and LaTeX before PDF generation
         
         if 'exercises' in doc:
+            await process_exercises_content(doc['exercises'])
             for exercise in doc['exercises']:
-                if 'enonce' in exercise and exercise['enonce']:
-                    exercise['enonce'] = process_exercise_content(exercise['enonce'])
-                
                 # NEW: Generate SVG for schema if present in donnees
                 if exercise.get('donnees') and isinstance(exercise['donnees'], dict):
                     schema_data = exercise['donnees'].get('schema')
@@ -3301,33 +3382,23 @@ async def export_pdf(request: ExportRequest, http_request: Request):
                         exercise['schema_svg'] = ""
                 else:
                     exercise['schema_svg'] = ""
-                
-                # Process solution if it exists
-                if exercise.get('solution'):
-                    if exercise['solution'].get('resultat'):
-                        exercise['solution']['resultat'] = process_exercise_content(exercise['solution']['resultat'])
-                        
-                    if exercise['solution'].get('etapes') and isinstance(exercise['solution']['etapes'], list):
-                        exercise['solution']['etapes'] = [
-                            process_exercise_content(step) for step in exercise['solution']['etapes']
-                        ]
             
 
         # Convert to Document object
         if isinstance(doc.get('created_at'), str):
             doc['created_at'] = datetime.fromisoformat(doc['created_at'])
-        document = Document(**doc)
+        document = document_from_db(doc)
         
         # NEW TEMPLATE STYLE SYSTEM - Choose template based on requested style
         requested_style = request.template_style or "classique"
         logger.info(f"🎨 TEMPLATE STYLE EXPORT - Requested style: {requested_style}, Pro user: {is_pro_user}")
         
-        # Validate style permission
-        if requested_style not in EXPORT_TEMPLATE_STYLES:
+        # Validate style permission - a single whitelist lookup
+        style_config = EXPORT_TEMPLATE_STYLES.get(requested_style)
+        if style_config is None:
             logger.warning(f"Invalid template style: {requested_style}, falling back to classique")
             requested_style = "classique"
-        
-        style_config = EXPORT_TEMPLATE_STYLES[requested_style]
+            style_config = EXPORT_TEMPLATE_STYLES["classique"]
         
         # Check if user has permission for this style
         if "free" not in style_config["available_for"] and not is_pro_user:
@@ -3342,7 +3413,7 @@ async def export_pdf(request: ExportRequest, http_request: Request):
             template_name = style_config["corrige_template"]
         
         logger.info(f"📄 Using template: {template_name} for style: {requested_style}")
-        template_content = load_template(template_name)
+        template = get_jinja_template(template_name)
         
         # Prepare render context
         render_context = {
@@ -3354,11 +3425,8 @@ async def export_pdf(request: ExportRequest, http_request: Request):
         # Add Pro personalization if available
         if is_pro_user and template_config:
             render_context['template_config'] = template_config
-            render_context['school_name'] = template_config.get('school_name')
-            render_context['professor_name'] = template_config.get('professor_name')
-            render_context['school_year'] = template_config.get('school_year')
-            render_context['footer_text'] = template_config.get('footer_text')
-            render_context['logo_filename'] = template_config.get('logo_filename')
+            for key in PRO_RENDER_CONTEXT_KEYS:
+                render_context[key] = template_config.get(key)
             
             # Add template style for schema theming
             render_context['template_style'] = template_config.get('template_style', 'academique')
@@ -3368,7 +3436,7 @@ async def export_pdf(request: ExportRequest, http_request: Request):
             if logo_url and logo_url.startswith('/uploads/'):
                 logo_file_path = ROOT_DIR / logo_url[1:]  # Remove leading slash
                 if logo_file_path.exists():
-                    absolute_logo_url = f"file://{logo_file_path}"
+                    absolute_logo_url = await get_logo_src(logo_file_path)
                     render_context['logo_url'] = absolute_logo_url
                     template_config['logo_url'] = absolute_logo_url
                     logger.info(f"✅ Logo converted for WeasyPrint: {logo_file_path}")
@@ -3382,7 +3450,7 @@ async def export_pdf(request: ExportRequest, http_request: Request):
             logger.info(f"🔍 FINAL RENDER CONTEXT FOR PRO USER:")
             logger.info(f"   school_name: {render_context.get('school_name')}")
             logger.info(f"   professor_name: {render_context.get('professor_name')}")
-            logger.info(f"   logo_url: {render_context.get('logo_url')}")
+            logger.info(f"   logo_url: {(render_context.get('logo_url') or '')[:80]}")
        
         # Generate filename with style suffix
         filename = f"LeMaitremot_{document.type_doc}_{document.matiere}_{document.niveau}_{request.export_type}_{requested_style}.pdf"
@@ -3467,18 +3535,12 @@ async def export_pdf(request: ExportRequest, http_request: Request):
         
         # Render HTML using Jinja2
         logger.info("🔧 Generating PDF with WeasyPrint...")
-        template = Template(template_content)
         html_content = template.render(**render_context)
         
         logger.info("✅ Mathematical expressions converted to SVG")
         
-        # Generate PDF with WeasyPrint
-        pdf_bytes = weasyprint.HTML(string=html_content).write_pdf()
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        temp_file.write(pdf_bytes)
-        temp_file.close()
+        # Generate PDF with WeasyPrint in a worker process
+        pdf_bytes = await pdf_render_pool.render(html_content)
         
         # Track export for guest quota (only for non-Pro users)
         if not is_pro_user and request.guest_id:
@@ -3489,23 +3551,24 @@ async def export_pdf(request: ExportRequest, http_request: Request):
                 "guest_id": request.guest_id,
                 "user_email": user_email,
                 "is_pro": is_pro_user,
-                "template_used": template_config.get('template_style') if template_config else 'standard',
+                # Guests never get a Pro template config, so their exports are always 'standard'
+                "template_used": 'standard',
                 "created_at": datetime.now(timezone.utc)
             }
-            await db.exports.insert_one(export_record)
+            background_tasks.add_task(record_export, export_record)
         
         logger.info(f"✅ PDF generated successfully: {filename}")
         
-        return FileResponse(
-            temp_file.name,
-            media_type='application/pdf',
-            filename=filename
-        )
+        return pdf_response(pdf_bytes, filename)
         
     except HTTPException:
+        if quota_reservation:
+            await guest_quotas.release(request.guest_id, quota_reservation)
         raise
     except Exception as e:
         logger.error(f"Error exporting PDF: {e}")
+        if quota_reservation:
+            await guest_quotas.release(request.guest_id, quota_reservation)
         raise HTTPException(status_code=500, detail="Erreur lors de l'export PDF")
         
     except HTTPException:
@@ -3515,7 +3578,7 @@ async def export_pdf(request: ExportRequest, http_request: Request):
         raise HTTPException(status_code=500, detail="Erreur lors de l'export PDF")
 
 @api_router.post("/export/advanced")
-async def export_pdf_advanced(request: EnhancedExportRequest, http_request: Request):
+async def export_pdf_advanced(request: EnhancedExportRequest, http_request: Request, background_tasks: BackgroundTasks):
     """Export document as PDF with advanced layout options (Pro only)"""
     try:
         # Check authentication - Pro only feature
@@ -3523,11 +3586,10 @@ async def export_pdf_advanced(request: EnhancedExportRequest, http_request: Requ
         if not session_token:
             raise HTTPException(status_code=401, detail="Session token requis pour les options avancées")
         
-        email = await validate_session_token(session_token)
+        email, is_pro, user = await resolve_session(session_token)
         if not email:
             raise HTTPException(status_code=401, detail="Session token invalide")
         
-        is_pro, user = await check_user_pro_status(email)
         if not is_pro:
             raise HTTPException(status_code=403, detail="Fonctionnalité Pro uniquement")
         
@@ -3540,23 +3602,11 @@ async def export_pdf_advanced(request: EnhancedExportRequest, http_request: Requ
         
         # CRITICAL: Process geometric schemas and LaTeX before PDF generation
         if 'exercises' in document:
-            for exercise in document['exercises']:
-                if 'enonce' in exercise and exercise['enonce']:
-                    exercise['enonce'] = process_exercise_content(exercise['enonce'])
-                
-                # Process solution if it exists
-                if exercise.get('solution'):
-                    if exercise['solution'].get('resultat'):
-                        exercise['solution']['resultat'] = process_exercise_content(exercise['solution']['resultat'])
-                        
-                    if exercise['solution'].get('etapes') and isinstance(exercise['solution']['etapes'], list):
-                        exercise['solution']['etapes'] = [
-                            process_exercise_content(step) for step in exercise['solution']['etapes']
-                        ]
+            await process_exercises_content(document['exercises'])
         
         # Load user template configuration
         template_config = {}
-        template_doc = await db.user_templates.find_one({"user_email": email})
+        template_doc = await db.user_templates.find_one({"user_email": email}, TEMPLATE_CONFIG_PROJECTION)
         if template_doc:
             template_config = {
                 'template_style': template_doc.get('template_style', 'minimaliste'),
@@ -3584,11 +3634,6 @@ async def export_pdf_advanced(request: EnhancedExportRequest, http_request: Requ
             document, content, request.export_type, template_config, advanced_opts
         )
         
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        temp_file.write(pdf_content)
-        temp_file.close()
-        
         # Generate filename
         filename = f"LeMaitremot_{request.export_type}_{document['matiere']}_{document['niveau']}_advanced.pdf"
         
@@ -3600,18 +3645,14 @@ async def export_pdf_advanced(request: EnhancedExportRequest, http_request: Requ
             "user_email": email,
             "is_pro": True,
             "template_used": template_config.get('template_style', 'minimaliste'),
-            "advanced_options": advanced_opts.dict(),
+            "advanced_options": advanced_opts.model_dump(),
             "created_at": datetime.now(timezone.utc)
         }
-        await db.exports.insert_one(export_record)
+        background_tasks.add_task(record_export, export_record)
         
         logger.info(f"✅ Advanced PDF generated successfully: {filename}")
         
-        return FileResponse(
-            temp_file.name,
-            media_type='application/pdf',
-            filename=filename
-        )
+        return pdf_response(pdf_content, filename)
         
     except HTTPException:
         raise
@@ -3635,12 +3676,10 @@ async def create_checkout_session(request: CheckoutRequest, http_request: Reques
                 subscription_type = existing_user.get("subscription_type", "inconnu")
                 
                 # Format expiration date for display
-                if isinstance(subscription_expires, str):
-                    expires_date = datetime.fromisoformat(subscription_expires).replace(tzinfo=timezone.utc)
-                elif isinstance(subscription_expires, datetime):
-                    expires_date = subscription_expires.replace(tzinfo=timezone.utc) if subscription_expires.tzinfo is None else subscription_expires
+                if subscription_expires:
+                    expires_date = as_utc(subscription_expires)
                 else:
-                    expires_date = datetime.now(timezone.utc) + timedelta(days=30)  # fallback
+                    expires_date = _utcnow() + SUBSCRIPTION_DURATIONS["monthly"]  # fallback
                 
                 formatted_date = expires_date.strftime("%d/%m/%Y")
                 
@@ -3663,7 +3702,7 @@ async def create_checkout_session(request: CheckoutRequest, http_request: Reques
         # Initialize Stripe
         host_url = str(http_request.base_url).rstrip('/')
         webhook_url = f"{host_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_secret_key, webhook_url=webhook_url)
+        stripe_checkout = get_stripe_checkout(webhook_url)
         
         # Build URLs from frontend origin
         success_url = f"{request.origin_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
@@ -3703,7 +3742,7 @@ async def create_checkout_session(request: CheckoutRequest, http_request: Reques
         )
         
         # Save to database
-        await db.payment_transactions.insert_one(transaction.dict())
+        await payment_transactions_inserter.insert(transaction.model_dump())
         
         logger.info(f"Checkout session created: {session.session_id}")
         
@@ -3723,34 +3762,37 @@ async def get_checkout_status(session_id: str):
     """Get checkout session status"""
     try:
         # Initialize Stripe
-        stripe_checkout = StripeCheckout(api_key=stripe_secret_key, webhook_url="")
+        stripe_checkout = get_stripe_checkout()
         
         # Get status from Stripe
         status = await stripe_checkout.get_checkout_status(session_id)
         
-        # Find transaction in database
-        transaction = await db.payment_transactions.find_one({"session_id": session_id})
-        
-        if not transaction:
-            raise HTTPException(status_code=404, detail="Transaction non trouvée")
-        
-        # Update transaction status if payment completed
-        if status.payment_status == "paid" and transaction.get("payment_status") != "paid":
-            # Update transaction
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
+        # Flip the transaction to paid and read its previous state in one round-trip.
+        # The payment_status filter makes this atomic: only the first poll (or webhook)
+        # to see the payment provisions the Pro account.
+        transaction = None
+        if status.payment_status == "paid":
+            transaction = await db.payment_transactions.find_one_and_update(
+                {"session_id": session_id, "payment_status": {"$ne": "paid"}},
                 {
                     "$set": {
                         "payment_status": "paid",
                         "session_status": "complete",
-                        "updated_at": datetime.now(timezone.utc)
+                        "updated_at": _utcnow()
                     }
-                }
+                },
+                return_document=ReturnDocument.BEFORE
             )
             
-            # Create or update Pro user
-            if transaction.get("email"):
-                await create_pro_user_from_transaction(transaction, status)
+            # Create or update Pro user; a failure puts the transaction back to its
+            # previous status so the webhook or the next poll provisions it
+            if transaction and transaction.get("email"):
+                await _safe_provision(transaction, status)
+        
+        # Nothing updated: already paid, not paid yet, or unknown session
+        if transaction is None:
+            if not await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Transaction non trouvée")
         
         return {
             "session_id": session_id,
@@ -3772,55 +3814,73 @@ async def create_pro_user_from_transaction(transaction: dict, status):
         package = PRICING_PACKAGES[transaction["package_id"]]
         
         # Calculate precise expiration date based on subscription type
-        now = datetime.now(timezone.utc)
-        if package["duration"] == "monthly":
-            # Add exactly 1 month (30 days)
-            expires = now + timedelta(days=30)
-            logger.info(f"Monthly subscription: expires in 30 days ({expires.strftime('%d/%m/%Y %H:%M')})")
-        else:  # yearly
-            # Add exactly 1 year (365 days)
-            expires = now + timedelta(days=365)
-            logger.info(f"Yearly subscription: expires in 365 days ({expires.strftime('%d/%m/%Y %H:%M')})")
-        
-        # Check if user already exists (upgrade/renewal scenario)
-        existing_user = await db.pro_users.find_one({"email": transaction["email"]})
-        
-        if existing_user:
-            # User exists - extend subscription from current expiration or now, whichever is later
-            current_expires = existing_user.get("subscription_expires")
-            if current_expires:
-                if isinstance(current_expires, str):
-                    current_expires = datetime.fromisoformat(current_expires).replace(tzinfo=timezone.utc)
-                elif isinstance(current_expires, datetime) and current_expires.tzinfo is None:
-                    current_expires = current_expires.replace(tzinfo=timezone.utc)
-                
-                # If current subscription is still active, extend from expiration date
-                if current_expires > now:
-                    if package["duration"] == "monthly":
-                        expires = current_expires + timedelta(days=30)
-                    else:  # yearly
-                        expires = current_expires + timedelta(days=365)
-                    logger.info(f"Extending existing subscription from {current_expires.strftime('%d/%m/%Y')} to {expires.strftime('%d/%m/%Y')}")
-        
-        # Create/Update Pro user
-        pro_user = ProUser(
-            email=transaction["email"],
-            nom=transaction.get("metadata", {}).get("nom") or existing_user.get("nom") if existing_user else None,
-            etablissement=transaction.get("metadata", {}).get("etablissement") or existing_user.get("etablissement") if existing_user else None,
-            subscription_type=package["duration"],
-            subscription_expires=expires,
-            last_login=existing_user.get("last_login") if existing_user else None
-        )
-        
-        # Save to database (upsert)
-        result = await db.pro_users.update_one(
-            {"email": transaction["email"]},
-            {"$set": pro_user.dict()},
-            upsert=True
-        )
-        
-        action = "updated" if result.matched_count > 0 else "created"
-        logger.info(f"Pro user {action}: {transaction['email']} - {package['duration']} subscription expires {expires.strftime('%d/%m/%Y %H:%M')}")
+        now = _utcnow()
+        duration = SUBSCRIPTION_DURATIONS[package["duration"]]
+        expires = now + duration
+        logger.info("%s subscription: expires in %s days (%s)", package["duration"], duration.days, expires)
+        
+        # Upgrade/renewal: an active subscription is extended from its current expiration
+        # date. The rule is evaluated by MongoDB in a pipeline update, so the previous
+        # state is read and the new one written in a single round-trip. Client-provided
+        # values are wrapped in $literal so they are never read as field paths.
+        # subscription_expires is always written as a UTC date: `now`/`expires` are aware
+        # UTC datetimes, and a legacy ISO string is converted before being compared or
+        # extended (a string would otherwise sort below any date and lose the remaining days).
+        # The session id is recorded on the user and the update only matches users that
+        # don't have it yet, so a retried write whose acknowledgement was lost can't
+        # extend the subscription twice.
+        email = transaction["email"]
+        session_id = transaction["session_id"]
+        metadata = transaction.get("metadata") or {}
+        new_user_id = str(uuid.uuid4())
+        try:
+            user = await db.pro_users.find_one_and_update(
+                {"email": email, "provisioned_sessions": {"$ne": session_id}},
+                [{"$set": {
+                    "id": {"$ifNull": ["$id", new_user_id]},
+                    "email": {"$literal": email},
+                    "nom": {"$ifNull": [{"$literal": metadata.get("nom") or None}, "$nom"]},
+                    "etablissement": {"$ifNull": [{"$literal": metadata.get("etablissement") or None}, "$etablissement"]},
+                    "account_type": "pro",
+                    "subscription_type": {"$literal": package["duration"]},
+                    "subscription_expires": {"$let": {
+                        "vars": {"current": {"$convert": {
+                            "input": "$subscription_expires", "to": "date", "onError": None, "onNull": None
+                        }}},
+                        "in": {"$cond": [
+                            {"$gt": ["$$current", now]},
+                            {"$add": ["$$current", int(duration.total_seconds() * 1000)]},
+                            expires
+                        ]}
+                    }},
+                    "stripe_customer_id": {"$ifNull": ["$stripe_customer_id", None]},
+                    "created_at": {"$ifNull": ["$created_at", now]},
+                    "last_login": {"$ifNull": ["$last_login", None]},
+                    "provisioned_sessions": {"$concatArrays": [
+                        {"$ifNull": ["$provisioned_sessions", []]}, [{"$literal": session_id}]
+                    ]}
+                }}],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # No user without this session: either it was already applied (the upsert then
+            # collides with the existing email) or a concurrent first purchase won the insert
+            user = await db.pro_users.find_one({"email": email, "provisioned_sessions": session_id})
+            if user is None:
+                raise
+            logger.info(f"Session {session_id} already applied to {email}")
+            await invalidate_pro_session_cache(email=email)
+            return as_utc(user["subscription_expires"])
+        await invalidate_pro_session_cache(email=email)
+        
+        stored_expires = as_utc(user["subscription_expires"])
+        if stored_expires > expires:
+            logger.info(f"Extended existing subscription to {stored_expires.strftime('%d/%m/%Y')}")
+        expires = stored_expires
+        
+        action = "created" if user["id"] == new_user_id else "updated"
+        logger.info(f"Pro user {action}: {email} - {package['duration']} subscription expires {expires.strftime('%d/%m/%Y %H:%M')}")
         
         return expires
         
@@ -3828,56 +3888,148 @@ async def create_pro_user_from_transaction(transaction: dict, status):
         logger.error(f"Error creating pro user: {e}")
         return None
 
+# Upper bound for a Stripe event payload
+WEBHOOK_MAX_BODY_BYTES = 2 * 1024 * 1024
+
+# Live fire-and-forget tasks, referenced until done so they aren't garbage collected
+_bg_tasks = set()
+
+def spawn_background(coro) -> asyncio.Task:
+    """Schedule a coroutine outside the request lifecycle"""
+    task = asyncio.create_task(coro)
+    _bg_tasks.add(task)
+    task.add_done_callback(_bg_tasks.discard)
+    return task
+
+async def _safe_provision(transaction: dict, status, event_id: Optional[str] = None, attempts: int = 3):
+    """Provision a Pro user from a paid transaction, retrying transient failures
+    
+    ``transaction`` is the document as it was before being marked paid. If provisioning
+    fails (or raises, or is cancelled) its previous payment_status is restored and the
+    webhook event, if any, is forgotten, so a redelivery from Stripe or the checkout
+    status poll can provision the user.
+    """
+    expires = None
+    try:
+        for attempt in range(1, attempts + 1):
+            expires = await create_pro_user_from_transaction(transaction, status)
+            if expires is not None:
+                return expires
+            if attempt < attempts:
+                await asyncio.sleep(2 ** attempt)
+        
+        logger.error(
+            "Pro user provisioning failed after %s attempts for session %s",
+            attempts,
+            transaction.get("session_id")
+        )
+        return None
+    finally:
+        if expires is None:
+            try:
+                if event_id:
+                    await db.webhook_events.delete_one({"event_id": event_id})
+                await db.payment_transactions.update_one(
+                    {"session_id": transaction.get("session_id")},
+                    {"$set": {"payment_status": transaction.get("payment_status")}}
+                )
+            except Exception:
+                logger.exception("Could not release payment %s", transaction.get("session_id"))
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     """Handle Stripe webhooks"""
     try:
-        body = await request.body()
+        # Reject unsigned calls before reading anything from the socket
         stripe_signature = request.headers.get("Stripe-Signature")
         
         if not stripe_signature:
             raise HTTPException(status_code=400, detail="Missing Stripe signature")
         
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > WEBHOOK_MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="Webhook payload too large")
+        
+        # Assemble the raw payload once while it is received
+        body_parts = bytearray()
+        async for chunk in request.stream():
+            body_parts += chunk
+            if len(body_parts) > WEBHOOK_MAX_BODY_BYTES:
+                raise HTTPException(status_code=413, detail="Webhook payload too large")
+        body = bytes(body_parts)
+        
         # Initialize Stripe
-        stripe_checkout = StripeCheckout(api_key=stripe_secret_key, webhook_url="")
+        stripe_checkout = get_stripe_checkout()
         
         # Handle webhook
         webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
         
-        logger.info(f"Webhook received: {webhook_response.event_type} for session {webhook_response.session_id}")
+        logger.info("Webhook received: %s for session %s", webhook_response.event_type, webhook_response.session_id)
         
-        # Process the webhook based on event type
-        if webhook_response.event_type == "checkout.session.completed":
-            # Find and update transaction
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {
-                    "$set": {
-                        "payment_status": webhook_response.payment_status,
-                        "session_status": "complete",
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
-            )
-            
-            # Get transaction details for user creation
-            transaction = await db.payment_transactions.find_one({"session_id": webhook_response.session_id})
-            if transaction and transaction.get("email"):
-                # Create Pro user
-                await create_pro_user_from_transaction(transaction, webhook_response)
+        # Record the event first: Stripe retries deliveries and the unique index on
+        # event_id turns a repeat into a single rejected insert
+        event_id = getattr(webhook_response, "event_id", None) or f"{webhook_response.session_id}:{webhook_response.event_type}"
+        try:
+            await db.webhook_events.insert_one({
+                "event_id": event_id,
+                "ts": _utcnow()
+            })
+        except DuplicateKeyError:
+            logger.info("Duplicate webhook ignored: %s", event_id)
+            return {"status": "duplicate"}
+        
+        try:
+            # Process the webhook based on event type
+            if webhook_response.event_type == "checkout.session.completed":
+                # Update the transaction and get it back in one round-trip. The previous
+                # state tells whether the checkout status poll already provisioned it.
+                transaction = await db.payment_transactions.find_one_and_update(
+                    {"session_id": webhook_response.session_id},
+                    {
+                        "$set": {
+                            "payment_status": webhook_response.payment_status,
+                            "session_status": "complete",
+                            "updated_at": _utcnow()
+                        }
+                    },
+                    return_document=ReturnDocument.BEFORE
+                )
+                
+                if (transaction and transaction.get("email")
+                        and webhook_response.payment_status == "paid"
+                        and transaction.get("payment_status") != "paid"):
+                    # Create Pro user in the background so Stripe gets its ACK right away
+                    spawn_background(_safe_provision(transaction, webhook_response, event_id))
+        except Exception:
+            # Let Stripe's retry process the event again
+            await db.webhook_events.delete_one({"event_id": event_id})
+            raise
         
         return {"status": "success"}
         
-    except Exception as e:
-        logger.error(f"Webhook error: {e}")
+    except (HTTPException, asyncio.CancelledError):
+        raise
+    except Exception:
+        logger.exception("Webhook processing failed")
         raise HTTPException(status_code=400, detail="Webhook processing error")
 
 @api_router.get("/user/status/{email}")
-async def get_user_status(email: str):
+async def get_user_status(email: str, request: Request, response: Response):
     """Get user Pro status"""
     try:
         is_pro, user = await check_user_pro_status(email)
         
+        if is_pro:
+            etag = compute_etag(email, True, user.get("subscription_type"), user.get("subscription_expires"))
+        else:
+            etag = compute_etag(email, False)
+        
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = POLLING_CACHE_CONTROL
+        
         if is_pro:
             return {
                 "is_pro": True,
@@ -3891,13 +4043,15 @@ async def get_user_status(email: str):
                 "account_type": "guest"
             }
             
-    except Exception as e:
-        logger.error(f"Error getting user status: {e}")
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Error getting user status")
         return {"is_pro": False, "account_type": "guest"}
 
 @api_router.get("/documents")
 @log_execution_time("get_documents")
-async def get_documents(guest_id: str = None):
+async def get_documents(request: Request, response: Response, guest_id: str = None):
     """Get user documents"""
     logger = get_logger()
     user_type = "guest" if guest_id else "unknown"
@@ -3912,8 +4066,30 @@ async def get_documents(guest_id: str = None):
     
     try:
         if guest_id:
-            # Get documents for guest user
-            documents = await db.documents.find({"guest_id": guest_id}).sort("created_at", -1).limit(20).to_list(length=20)
+            # Cheap freshness token: any new, deleted or varied document changes it
+            freshness = await db.documents.aggregate([
+                {"$match": {"guest_id": guest_id}},
+                {"$group": {
+                    "_id": None,
+                    "count": {"$sum": 1},
+                    "last_created": {"$max": "$created_at"},
+                    "last_updated": {"$max": "$updated_at"}
+                }}
+            ]).to_list(1)
+            stats = freshness[0] if freshness else {}
+            etag = compute_etag(guest_id, stats.get("count", 0), stats.get("last_created"), stats.get("last_updated"))
+            
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = POLLING_CACHE_CONTROL
+            
+            # Get documents for guest user (served by the guest_id/created_at index;
+            # _id is dropped server-side since it can't be JSON serialized)
+            documents = await db.documents.find(
+                {"guest_id": guest_id}, {"_id": 0}
+            ).sort("created_at", -1).limit(20).to_list(length=20)
         else:
             return {"documents": []}
         
@@ -3924,10 +4100,8 @@ async def get_documents(guest_id: str = None):
             # Apply professional content processing to ensure consistency
             # Process all content systematically to handle both old and new documents
             if 'exercises' in doc:
+                await process_exercises_content(doc['exercises'])
                 for exercise in doc['exercises']:
-                    if 'enonce' in exercise and exercise['enonce']:
-                        exercise['enonce'] = process_exercise_content(exercise['enonce'])
-                    
                     # schema_img is now generated during exercise creation, no need to process again
                     if exercise.get('schema_img'):
                         logger.debug(
@@ -3937,93 +4111,227 @@ async def get_documents(guest_id: str = None):
                             doc_id=str(doc.get('id', 'unknown'))[:8],
                             has_schema_img=bool(exercise.get('schema_img'))
                         )
-
-                    # Process solution if it exists
-                    if exercise.get('solution'):
-                        if exercise['solution'].get('resultat'):
-                            exercise['solution']['resultat'] = process_exercise_content(exercise['solution']['resultat'])
-                                
-                        if exercise['solution'].get('etapes') and isinstance(exercise['solution']['etapes'], list):
-                            exercise['solution']['etapes'] = [
-                                process_exercise_content(step) for step in exercise['solution']['etapes']
-                            ]
-        
-        # Clean up MongoDB-specific fields that can't be JSON serialized
-        for doc in documents:
-            # Remove MongoDB ObjectId fields that cause serialization issues
-            if '_id' in doc:
-                del doc['_id']
         
         # Return raw documents to preserve dynamic fields like schema_img
         # Don't use Pydantic models here as they filter out dynamic fields
         return {"documents": documents}
         
-    except Exception as e:
-        logger.error(f"Error getting documents: {e}")
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Error getting documents for guest %s", guest_id[:8] if guest_id else None)
         return {"documents": []}
 
+# Generation parameters of a document, in generate_exercises_with_ai order
+VARY_PARAM_FIELDS = ("matiere", "niveau", "chapitre", "type_doc", "difficulte")
+
+async def get_document_vary_meta(document_id: str):
+    """Fetch the fields needed to vary exercises, with the exercise count computed by MongoDB"""
+    pipeline = [
+        {"$match": {"id": document_id}},
+        {"$limit": 1},
+        {"$project": {
+            "_id": 0,
+            **{field: 1 for field in VARY_PARAM_FIELDS},
+            "_ex_count": {"$size": {"$ifNull": ["$exercises", []]}}
+        }}
+    ]
+    results = await db.documents.aggregate(pipeline).to_list(1)
+    return results[0] if results else None
+
 @api_router.post("/documents/{document_id}/vary/{exercise_index}")
-async def vary_exercise(document_id: str, exercise_index: int):
+async def vary_exercise(
+    document_id: str,
+    exercise_index: int,
+    matiere: Optional[str] = None,
+    niveau: Optional[str] = None,
+    chapitre: Optional[str] = None,
+    type_doc: Optional[str] = None,
+    difficulte: Optional[str] = None
+):
     """Generate a variation of a specific exercise"""
+    gen_task = None
+    client_params = (matiere, niveau, chapitre, type_doc, difficulte)
     try:
-        # Find the document
-        doc = await db.documents.find_one({"id": document_id})
+        # When the client already knows the generation parameters, start the AI call
+        # right away so it overlaps with the document lookup
+        if all(client_params):
+            gen_task = asyncio.create_task(generate_exercises_with_ai(
+                matiere, niveau, chapitre, type_doc, difficulte,
+                1  # Just one exercise
+            ))
+        
+        # Find the document - generation parameters plus a server-side exercise count
+        doc = await get_document_vary_meta(document_id)
         if not doc:
             raise HTTPException(status_code=404, detail="Document non trouvé")
         
-        if exercise_index >= len(doc.get("exercises", [])):
+        if exercise_index < 0 or exercise_index >= doc["_ex_count"]:
             raise HTTPException(status_code=400, detail="Index d'exercice invalide")
         
+        # The stored document is authoritative: a speculative generation started with
+        # other parameters is discarded
+        if gen_task is not None and client_params != tuple(doc.get(field) for field in VARY_PARAM_FIELDS):
+            logger.warning("vary_exercise: client parameters differ from document %s, regenerating", document_id)
+            gen_task.cancel()
+            gen_task = None
+        
         # Generate a new variation
-        exercises = await generate_exercises_with_ai(
-            doc["matiere"],
-            doc["niveau"],
-            doc["chapitre"],
-            doc["type_doc"],
-            doc["difficulte"],
-            1  # Just one exercise
-        )
+        if gen_task is not None:
+            exercises = await gen_task
+        else:
+            exercises = await generate_exercises_with_ai(
+                doc["matiere"],
+                doc["niveau"],
+                doc["chapitre"],
+                doc["type_doc"],
+                doc["difficulte"],
+                1  # Just one exercise
+            )
         
         if exercises:
             # Update the specific exercise
             # Convert Exercise object to dict for MongoDB storage
-            exercise_dict = exercises[0].dict() if hasattr(exercises[0], 'dict') else exercises[0]
-            doc["exercises"][exercise_index] = exercise_dict
-            await db.documents.update_one(
-                {"id": document_id},
-                {"$set": {"exercises": doc["exercises"]}}
+            exercise_dict = exercises[0].model_dump() if hasattr(exercises[0], 'model_dump') else exercises[0]
+            # Patch only the targeted slot instead of rewriting the whole array; the
+            # $exists filter keeps $set from padding the array if it shrank meanwhile
+            result = await db.documents.update_one(
+                {"id": document_id, f"exercises.{exercise_index}": {"$exists": True}},
+                {"$set": {
+                    f"exercises.{exercise_index}": exercise_dict,
+                    "updated_at": datetime.now(timezone.utc)
+                }}
             )
+            if result.matched_count == 0:
+                raise HTTPException(status_code=404, detail="Exercice non trouvé")
             
             # Return the exercise as dict for JSON serialization
             return {"exercise": exercise_dict}
         
         raise HTTPException(status_code=500, detail="Impossible de générer une variation")
         
-    except HTTPException:
+    except (HTTPException, asyncio.CancelledError):
+        if gen_task is not None and not gen_task.done():
+            gen_task.cancel()
         raise
-    except Exception as e:
-        logger.error(f"Error varying exercise: {e}")
+    except Exception:
+        if gen_task is not None and not gen_task.done():
+            gen_task.cancel()
+        logger.exception("vary_exercise failed for %s/%s", document_id, exercise_index)
         raise HTTPException(status_code=500, detail="Erreur lors de la génération de la variation")
 
+@api_router.post("/documents/{document_id}/vary")
+async def vary_exercises(document_id: str, request: VaryExercisesRequest):
+    """Generate variations for several exercises of a document in one pass"""
+    try:
+        # Keep the first occurrence of each index, in request order
+        indices = list(dict.fromkeys(request.indices))
+        if not indices:
+            raise HTTPException(status_code=400, detail="Aucun exercice à varier")
+        
+        doc = await get_document_vary_meta(document_id)
+        if not doc:
+            raise HTTPException(status_code=404, detail="Document non trouvé")
+        
+        if any(i < 0 or i >= doc["_ex_count"] for i in indices):
+            raise HTTPException(status_code=400, detail="Index d'exercice invalide")
+        
+        # Generate all the variations with a single AI call
+        exercises = await generate_exercises_with_ai(
+            doc["matiere"],
+            doc["niveau"],
+            doc["chapitre"],
+            doc["type_doc"],
+            doc["difficulte"],
+            len(indices)
+        )
+        
+        if not exercises:
+            raise HTTPException(status_code=500, detail="Impossible de générer une variation")
+        
+        varied = {}
+        for exercise_index, exercise in zip(indices, exercises):
+            varied[exercise_index] = exercise.model_dump() if hasattr(exercise, 'model_dump') else exercise
+        
+        # The AI may return fewer exercises than requested: the remaining indices are
+        # left as they were and reported to the client
+        unchanged = indices[len(varied):]
+        if unchanged:
+            logger.warning("vary_exercises: AI returned %s of %s exercises for %s, unchanged: %s",
+                           len(varied), len(indices), document_id, unchanged)
+        
+        # One update for all the slots, so they are saved together or not at all. Every
+        # index is below the largest one, so checking that it still exists keeps $set
+        # from padding the array if it shrank while the variations were generated.
+        result = await db.documents.update_one(
+            {"id": document_id, f"exercises.{max(varied)}": {"$exists": True}},
+            {"$set": {
+                **{f"exercises.{i}": exercise_dict for i, exercise_dict in varied.items()},
+                "updated_at": datetime.now(timezone.utc)
+            }}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="Exercices non trouvés")
+        
+        return {
+            "exercises": [{"index": i, "exercise": exercise_dict} for i, exercise_dict in varied.items()],
+            "unchanged": unchanged
+        }
+        
+    except (HTTPException, asyncio.CancelledError):
+        raise
+    except Exception:
+        logger.exception("vary_exercises failed for %s/%s", document_id, request.indices)
+        raise HTTPException(status_code=500, detail="Erreur lors de la génération des variations")
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Resolve allowed origins once; browsers reject credentials with a wildcard origin anyway,
+# so only enable them for an explicit origin list
+CORS_ORIGINS = [o.strip() for o in os.environ.get('CORS_ORIGINS', '').split(',') if o.strip()] or ["*"]
+CORS_ALLOW_CREDENTIALS = CORS_ORIGINS != ["*"]
+
+app.add_middleware(RequestTimestampMiddleware)
 app.add_middleware(
     CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    allow_credentials=CORS_ALLOW_CREDENTIALS,
+    allow_origins=CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Configure logging - handled by unified logger system
-logger = get_logger(__name__)
+# Document listings carry SVG and base64 schema images that compress several times over.
+# PDF downloads opt out with Content-Encoding: identity (see pdf_response).
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
 
 @app.on_event("startup")
 async def startup_event():
-    """Log server startup"""
+    """Ensure database indexes and log server startup"""
+    # Optional indexes that fail are logged by ensure_indexes; a missing required one
+    # raises and aborts startup
+    failed = await ensure_indexes(db)
+    if failed:
+        logger.warning(f"Server starting without indexes: {', '.join(failed)}")
+    try:
+        await normalize_subscription_expires(db)
+    except Exception as e:
+        logger.warning(f"Could not normalize subscription expiry dates: {e}")
+    try:
+        await normalize_session_dates(db)
+    except Exception as e:
+        logger.warning(f"Could not normalize login session dates: {e}")
     logger.info("🚀 Server started")
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    # Let in-flight background work (e.g. Pro provisioning) finish before closing Mongo
+    if _bg_tasks:
+        await asyncio.wait(set(_bg_tasks), timeout=10)
+    await exports_inserter.flush()
+    await payment_transactions_inserter.flush()
+    client.close()
+    await http_client.aclose()
+    if SESSION_REDIS is not None:
+        await SESSION_REDIS.aclose()
+    pdf_render_pool.shutdown()
+    content_render_pool.shutdown()
\ No newline at end of file
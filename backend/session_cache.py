@@ -0,0 +1,101 @@
+"""
+Session Cache - Short-lived session lookups, in-process or shared through Redis
+
+By default entries live in a per-process TTLCache. When REDIS_URL is set (and the
+redis package is installed) they are stored in Redis instead, so that a logout or a
+subscription change handled by one worker is seen by every worker.
+"""
+
+import os
+from typing import Any, Callable, Hashable
+
+from cachetools import TTLCache
+
+from logger import get_logger
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Optional dependency, only needed with REDIS_URL
+    redis_asyncio = None
+
+logger = get_logger(__name__)
+
+
+class SessionCache:
+    """Cache of session key -> value, where every entry belongs to a user email
+
+    ``dumps``/``loads`` convert values to and from strings for the Redis backend;
+    the in-process backend stores values as they are.
+    """
+
+    def __init__(self, namespace: str, maxsize: int, ttl: int, redis_client=None,
+                 dumps: Callable[[Any], str] = str, loads: Callable[[str], Any] = str):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.redis = redis_client
+        self.dumps = dumps
+        self.loads = loads
+        # key -> (email, value)
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl) if redis_client is None else None
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:k:{key}"
+
+    def _email_key(self, email: str) -> str:
+        return f"{self.namespace}:e:{email}"
+
+    async def get(self, key: Hashable):
+        if self._local is not None:
+            entry = self._local.get(key)
+            return entry[1] if entry is not None else None
+
+        # Redis being unavailable is a cache miss, callers fall back to MongoDB
+        try:
+            raw = await self.redis.get(self._key(key))
+        except Exception as e:
+            logger.error(f"Error reading session cache: {e}")
+            return None
+        return self.loads(raw) if raw is not None else None
+
+    async def set(self, key: Hashable, email: str, value):
+        if self._local is not None:
+            self._local[key] = (email, value)
+            return
+
+        # The per-email set lets delete_email find every session of a user
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(self._key(key), self.dumps(value), ex=self.ttl)
+                pipe.sadd(self._email_key(email), str(key))
+                pipe.expire(self._email_key(email), self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"Error writing session cache: {e}")
+
+    async def delete(self, key: Hashable):
+        if self._local is not None:
+            self._local.pop(key, None)
+            return
+
+        await self.redis.delete(self._key(key))
+
+    async def delete_email(self, email: str):
+        """Drop every entry belonging to an email"""
+        if self._local is not None:
+            for key in [k for k, (cached_email, _) in list(self._local.items()) if cached_email == email]:
+                self._local.pop(key, None)
+            return
+
+        keys = await self.redis.smembers(self._email_key(email))
+        await self.redis.delete(self._email_key(email), *[self._key(key) for key in keys])
+
+
+def create_redis_client():
+    """Redis client for REDIS_URL, or None to keep caches in-process"""
+    redis_url = os.environ.get('REDIS_URL')
+    if not redis_url:
+        return None
+    if redis_asyncio is None:
+        logger.warning("REDIS_URL is set but the redis package is not installed, session caches stay in-process")
+        return None
+    return redis_asyncio.Redis.from_url(redis_url, decode_responses=True)
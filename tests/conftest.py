@@ -0,0 +1,9 @@
+"""
+Configuration pytest commune : les logs des tests vont dans un répertoire temporaire
+"""
+
+import os
+import tempfile
+
+# Avant tout import de logger.py, pour ne jamais écrire dans le log/ du dépôt
+os.environ.setdefault("APP_LOG_DIR", tempfile.mkdtemp(prefix="lemaitremot-test-log-"))
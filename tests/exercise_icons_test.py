@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests de enrich_exercise_with_icon : type et icône des exercices
+"""
+
+import sys
+from pathlib import Path
+
+# Ajouter le répertoire backend au PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from exercise_icons import EXERCISE_ICON_MAPPING, enrich_exercise_with_icon, normalize_chapter
+
+
+def enrich(chapitre, enonce="", **exercise):
+    exercise["enonce"] = enonce
+    return enrich_exercise_with_icon(exercise, chapitre)
+
+
+class TestNormalizedChapterLookup:
+    """Les chapitres sont reconnus sans tenir compte de la casse ni des accents"""
+
+    def test_normalize_chapter(self):
+        assert normalize_chapter("  Théorème de Thalès ") == "theoreme de thales"
+        assert normalize_chapter("ÉQUATIONS") == "equations"
+
+    def test_exact_chapter(self):
+        result = enrich("Théorème de Pythagore")
+        assert result["icone"] == EXERCISE_ICON_MAPPING["Théorème de Pythagore"]
+        assert result["type"] == "geometry"
+
+    def test_chapter_without_accents_or_case(self):
+        for chapitre in ("theoreme de pythagore", "THÉORÈME DE PYTHAGORE", "Theoreme de Pythagore"):
+            result = enrich(chapitre)
+            assert result["icone"] == EXERCISE_ICON_MAPPING["Théorème de Pythagore"]
+            assert result["type"] == "geometry"
+
+    def test_chapter_type_matches_without_accents(self):
+        assert enrich("theoreme de thales")["type"] == "geometry"
+        assert enrich("equations")["type"] == "algebra"
+        assert enrich("probabilites")["type"] == "statistics"
+
+    def test_mapped_chapter_without_type_keyword_is_text(self):
+        result = enrich("matière")
+        assert result["icone"] == EXERCISE_ICON_MAPPING["Matière"]
+        assert result["type"] == "text"
+
+
+class TestPrecedence:
+    """Type IA > chapitre > contenu de l'énoncé > défaut"""
+
+    def test_ai_type_wins_over_chapter(self):
+        result = enrich("Fractions", "Calcule l'aire du triangle", type="Statistics")
+        assert result["type"] == "statistics"
+        assert result["icone"] == EXERCISE_ICON_MAPPING["statistics"]
+
+    def test_known_chapter_wins_over_content(self):
+        # Normalized lookup: "fractions" is the Fractions chapter, the triangle in
+        # the statement no longer decides the type
+        result = enrich("fractions", "Calcule l'aire du triangle ABC")
+        assert result["icone"] == EXERCISE_ICON_MAPPING["Fractions"]
+        assert result["type"] == "algebra"
+
+    def test_unknown_chapter_uses_content(self):
+        result = enrich("Révisions", "Calcule l'aire du triangle ABC")
+        assert result["type"] == "geometry"
+        assert result["icone"] == "triangle-ruler"
+
+    def test_content_priority_geometry_over_algebra(self):
+        result = enrich("Révisions", "Résoudre l'équation puis tracer le cercle")
+        assert result["type"] == "geometry"
+
+    def test_content_statistics(self):
+        result = enrich("Révisions", "Quelle est la moyenne des données ?")
+        assert result["type"] == "statistics"
+        assert result["icone"] == "bar-chart"
+
+    def test_default(self):
+        result = enrich("Révisions", "Lis le texte.")
+        assert result["type"] == "text"
+        assert result["icone"] == EXERCISE_ICON_MAPPING["default"]
+
+    def test_empty_chapter(self):
+        assert enrich("", "Lis le texte.")["icone"] == EXERCISE_ICON_MAPPING["default"]
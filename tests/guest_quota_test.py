@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Tests du quota d'exports invités (GuestQuotaStore)
+
+Les tests d'intégration tournent contre une vraie base MongoDB quand MONGO_URL est défini.
+"""
+
+import asyncio
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+# Ajouter le répertoire backend au PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+pytest.importorskip("pymongo")
+
+from pymongo.errors import DuplicateKeyError
+
+from guest_quota import GuestQuotaStore
+
+WINDOW = timedelta(days=30)
+
+
+class RacingCollection:
+    """Collection factice dont le premier upsert perd la course contre un autre export"""
+
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.calls = 0
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise DuplicateKeyError("E11000 duplicate key error")
+        reservation_id = update[1]["$set"]["reservation"]["$cond"][1]
+        return {"reservation": reservation_id}
+
+
+class TestReserveRetry:
+    """Un upsert concurrent sur un nouvel invité est rejoué une fois"""
+
+    def test_retries_once_after_duplicate_key(self):
+        collection = RacingCollection(failures=1)
+        store = GuestQuotaStore(collection, 3, WINDOW)
+        reservation = asyncio.run(store.reserve("guest-1"))
+        assert reservation is not None
+        assert collection.calls == 2
+
+    def test_second_duplicate_key_is_raised(self):
+        collection = RacingCollection(failures=2)
+        store = GuestQuotaStore(collection, 3, WINDOW)
+        with pytest.raises(DuplicateKeyError):
+            asyncio.run(store.reserve("guest-1"))
+        assert collection.calls == 2
+
+
+def run_with_database(test):
+    """Exécuter un test async sur une base temporaire (ignoré sans MONGO_URL)"""
+    mongo_url = os.environ.get("MONGO_URL")
+    if not mongo_url:
+        pytest.skip("MONGO_URL not set")
+    motor_asyncio = pytest.importorskip("motor.motor_asyncio")
+
+    async def run():
+        client = motor_asyncio.AsyncIOMotorClient(mongo_url, tz_aware=True)
+        db = client[f"test_guest_quota_{uuid.uuid4().hex[:8]}"]
+        try:
+            await db.guest_quotas.create_index("guest_id", unique=True)
+            await test(db, GuestQuotaStore(db.guest_quotas, 3, WINDOW))
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    asyncio.run(run())
+
+
+class TestReserveWithDatabase:
+    """Réservation, libération et fenêtre glissante sur MongoDB"""
+
+    def test_cap_is_enforced(self):
+        async def test(db, store):
+            reservations = [await store.reserve("guest-1") for _ in range(4)]
+            assert all(reservations[:3])
+            assert reservations[3] is None
+
+        run_with_database(test)
+
+    def test_concurrent_reservations_never_exceed_cap(self):
+        async def test(db, store):
+            reservations = await asyncio.gather(*[store.reserve("guest-1") for _ in range(10)])
+            assert len([r for r in reservations if r]) == 3
+            quota = await db.guest_quotas.find_one({"guest_id": "guest-1"})
+            assert len(quota["exports"]) == 3
+
+        run_with_database(test)
+
+    def test_release_gives_the_export_back(self):
+        async def test(db, store):
+            reservations = [await store.reserve("guest-1") for _ in range(3)]
+            assert await store.reserve("guest-1") is None
+            await store.release("guest-1", reservations[0])
+            assert await store.reserve("guest-1") is not None
+
+        run_with_database(test)
+
+    def test_expired_exports_are_dropped(self):
+        async def test(db, store):
+            old = datetime.now(timezone.utc) - WINDOW - timedelta(days=1)
+            await db.guest_quotas.insert_one({
+                "guest_id": "guest-1",
+                "exports": [{"id": str(i), "at": old} for i in range(3)]
+            })
+            assert await store.reserve("guest-1") is not None
+            quota = await db.guest_quotas.find_one({"guest_id": "guest-1"})
+            assert len(quota["exports"]) == 1
+
+        run_with_database(test)
+
+
+class TestSeedFromExports:
+    """Initialisation de guest_quotas à partir des exports existants"""
+
+    def test_seeds_recent_exports_once(self):
+        async def test(db, store):
+            now = datetime.now(timezone.utc)
+            await db.exports.insert_many([
+                {"id": "a", "guest_id": "guest-1", "created_at": now - timedelta(days=1)},
+                {"id": "b", "guest_id": "guest-1", "created_at": now - timedelta(days=2)},
+                {"id": "c", "guest_id": "guest-1", "created_at": now - WINDOW - timedelta(days=1)},
+                {"id": "d", "guest_id": None, "created_at": now},
+            ])
+            assert await store.seed_from_exports(db.exports) == 1
+            quota = await db.guest_quotas.find_one({"guest_id": "guest-1"})
+            assert sorted(export["id"] for export in quota["exports"]) == ["a", "b"]
+
+            # Une seule réservation restante, et un second passage ne change rien
+            assert await store.reserve("guest-1") is not None
+            assert await store.reserve("guest-1") is None
+            assert await store.seed_from_exports(db.exports) == 0
+
+        run_with_database(test)
+
+    def test_existing_quota_is_kept(self):
+        async def test(db, store):
+            now = datetime.now(timezone.utc)
+            await store.reserve("guest-1")
+            await db.exports.insert_one({"id": "a", "guest_id": "guest-1", "created_at": now})
+            assert await store.seed_from_exports(db.exports) == 0
+            quota = await db.guest_quotas.find_one({"guest_id": "guest-1"})
+            assert len(quota["exports"]) == 1
+
+        run_with_database(test)
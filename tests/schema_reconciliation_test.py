@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests de reconcile_enonce_schema : relations détectées dans l'énoncé
+"""
+
+import sys
+from pathlib import Path
+
+# Ajouter le répertoire backend au PYTHONPATH
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+from schema_reconciliation import reconcile_enonce_schema
+
+
+def reconcile(enonce, **schema):
+    schema.setdefault("type", "triangle")
+    schema.setdefault("points", ["A", "B", "C", "D", "E", "F", "G", "H"])
+    return reconcile_enonce_schema(enonce, schema)
+
+
+class TestChainedRelations:
+    """Relations enchaînées : chaque paire consécutive est détectée"""
+
+    def test_chained_parallels(self):
+        result = reconcile("AB // CD // EF")
+        assert result["paralleles"] == [[["A", "B"], ["C", "D"]], [["C", "D"], ["E", "F"]]]
+
+    def test_chained_parenthesized_parallels(self):
+        result = reconcile("(AB)//(CD)//(EF)")
+        assert result["paralleles"] == [[["A", "B"], ["C", "D"]], [["C", "D"], ["E", "F"]]]
+
+    def test_chained_perpendiculars(self):
+        result = reconcile("AB ⊥ CD ⊥ EF")
+        assert result["perpendiculaires"] == [[["A", "B"], ["C", "D"]], [["C", "D"], ["E", "F"]]]
+
+
+class TestDuplicateRelations:
+    """Une relation reconnue par plusieurs motifs n'est ajoutée qu'une fois"""
+
+    def test_spaced_and_unspaced_forms_give_one_entry(self):
+        result = reconcile("AB ⊥ BC")
+        assert result["perpendiculaires"] == [[["A", "B"], ["B", "C"]]]
+
+    def test_parallel_matched_by_two_patterns_gives_one_entry(self):
+        result = reconcile("Les droites AB // CD.")
+        assert result["paralleles"] == [[["A", "B"], ["C", "D"]]]
+
+
+class TestOverlappingRelations:
+    """Relations qui se chevauchent dans le texte"""
+
+    def test_length_with_and_without_keyword(self):
+        result = reconcile("longueur AB = 5 et BC = 3 cm")
+        assert result["segments"] == [["A", "B", {"longueur": 5.0}], ["B", "C", {"longueur": 3.0}]]
+
+    def test_parallel_followed_by_length(self):
+        result = reconcile("AB // CD = 4")
+        assert result["paralleles"] == [[["A", "B"], ["C", "D"]]]
+        assert result["segments"] == [["C", "D", {"longueur": 4.0}]]
+
+    def test_right_angle_inside_perpendicular_statement(self):
+        result = reconcile("(AB) perpendiculaire en B à (BC), AB ⊥ BC")
+        assert result["angles"] == [["B", {"angle_droit": True}]]
+        assert result["perpendiculaires"] == [[["A", "B"], ["B", "C"]]]
+
+
+class TestPointsAndCoordinates:
+    """Points et coordonnées extraits de l'énoncé"""
+
+    def test_missing_points_are_appended_sorted_and_placed(self):
+        result = reconcile_enonce_schema("Soit ABC un triangle.", {"type": "triangle", "points": ["B"]})
+        assert result["points"] == ["B", "A", "C"]
+        assert set(result["labels"]) == {"A", "C"}
+
+    def test_triangle_points_get_triangle_positions(self):
+        result = reconcile_enonce_schema("Triangle ABC", {"type": "triangle", "points": []})
+        assert result["labels"] == {"A": "(0,0)", "B": "(8,0)", "C": "(0,6)"}
+
+    def test_lowercase_words_are_not_points(self):
+        result = reconcile("Soit un Triangle rectangle")
+        assert "S" not in result["points"]
+        assert "T" not in result["points"]
+
+    def test_coordinates_from_text(self):
+        result = reconcile("A(0,3) et B(-2, 4.5)")
+        assert result["labels"]["A"] == "(0,3)"
+        assert result["labels"]["B"] == "(-2,4.5)"
+
+    def test_contradictory_coordinates_keep_schema_value(self):
+        result = reconcile("A(1,1)", labels={"A": "(0,0)"})
+        assert result["labels"]["A"] == "(0,0)"
+
+
+class TestLengthsAndAngles:
+    """Longueurs et angles droits"""
+
+    def test_length_updates_existing_segment(self):
+        result = reconcile("AB = 7 cm", segments=[["A", "B", {"longueur": 3}], ["B", "C", {}]])
+        assert result["segments"] == [["A", "B", {"longueur": 7.0}], ["B", "C", {}]]
+
+    def test_length_adds_missing_segment(self):
+        result = reconcile("A B = 2.5", segments=[])
+        assert result["segments"] == [["A", "B", {"longueur": 2.5}]]
+
+    def test_right_angle_forms(self):
+        for enonce in ("angle droit en B", "triangle rectangle en B", "perpendiculaire en B"):
+            assert reconcile(enonce)["angles"] == [["B", {"angle_droit": True}]]
+
+    def test_existing_right_angle_is_not_duplicated(self):
+        result = reconcile("rectangle en B", angles=[["B", {"angle_droit": True}]])
+        assert result["angles"] == [["B", {"angle_droit": True}]]
+
+
+class TestSchemaHandling:
+    """Cas limites et enrichissement en place"""
+
+    def test_empty_inputs(self):
+        assert reconcile_enonce_schema("", {"type": "triangle"}) == {"type": "triangle"}
+        assert reconcile_enonce_schema("AB = 3", None) == {}
+
+    def test_plain_text_adds_no_relations(self):
+        result = reconcile("Calculer la somme de deux nombres.")
+        for key in ("paralleles", "perpendiculaires", "segments", "angles"):
+            assert key not in result
+
+    def test_schema_is_enriched_in_place(self):
+        schema = {"type": "triangle", "points": ["A", "B"]}
+        result = reconcile_enonce_schema("AB = 4", schema)
+        assert result is schema
+        assert schema["segments"] == [["A", "B", {"longueur": 4.0}]]